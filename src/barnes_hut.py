@@ -0,0 +1,172 @@
+import numpy as np
+
+"""
+Barnes-Hut gravity solver.
+
+The quadtree is never built out of per-body node objects. Bodies are sorted along a Morton
+(Z-order) curve, so every quadtree node is a contiguous run of the sorted bodies and each
+level of the tree is found with a single pass over the sorted keys. The tree is stored as
+flat arrays, one entry per node:
+
+start, count - the run of sorted bodies inside the node
+mass, com - total mass and center of mass of the node
+size - side length of the node's square
+offset - distance between the node's center of mass and its geometric center
+level, prefix - depth of the node and the Morton key prefix shared by its bodies
+child_lo, child_hi - the node's children are the nodes in [child_lo, child_hi)
+
+The walk is vectorized too: a block of bodies descends the tree together as a list of
+(body, node) pairs, one tree level per iteration.
+"""
+MAX_DEPTH = 16 #deepest tree level, bodies closer than size / 2**16 share a leaf
+
+class Quadtree:
+    def __init__(self, position, mass, depth=MAX_DEPTH):
+        n = len(mass)
+        lo = position.min(axis=0)
+        span = float((position.max(axis=0) - lo).max())
+        self.size = span * (1 + 1e-9) if span > 0 else 1.0
+        self.depth = depth
+
+        #integer cell coordinates on the finest level, interleaved into Morton keys
+        cells = np.floor((position - lo) / self.size * 2 ** depth).astype(np.uint64)
+        cells = np.minimum(cells, np.uint64(2 ** depth - 1))
+        keys = _spread_bits(cells[:, 0]) | (_spread_bits(cells[:, 1]) << np.uint64(1))
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        self.position = position[self.order]
+        self.mass = mass[self.order]
+
+        starts, counts, masses, coms, levels, prefixes = [], [], [], [], [], []
+        weighted = self.position * self.mass[:, np.newaxis]
+        for level in range(depth + 1):
+            prefix = self.keys >> np.uint64(2 * (depth - level))
+            start = np.flatnonzero(np.r_[True, prefix[1:] != prefix[:-1]])
+            count = np.diff(np.r_[start, n])
+            node_mass = np.add.reduceat(self.mass, start)
+            com = np.add.reduceat(weighted, start, axis=0)
+            #massless nodes fall back to their geometric center
+            massless = node_mass <= 0
+            com[~massless] /= node_mass[~massless, np.newaxis]
+            if massless.any():
+                com[massless] = (np.add.reduceat(self.position, start, axis=0) / count[:, np.newaxis])[massless]
+            starts.append(start)
+            counts.append(count)
+            masses.append(node_mass)
+            coms.append(com)
+            levels.append(np.full(len(start), level))
+            prefixes.append(prefix[start])
+            #no need to go deeper once every node holds a single body
+            if count.max() == 1:
+                break
+
+        offsets = np.cumsum([0] + [len(s) for s in starts])
+        child_lo, child_hi = [], []
+        for level, (start, count) in enumerate(zip(starts, counts)):
+            if level + 1 < len(starts):
+                child_lo.append(np.searchsorted(starts[level + 1], start) + offsets[level + 1])
+                child_hi.append(np.searchsorted(starts[level + 1], start + count) + offsets[level + 1])
+            else:
+                child_lo.append(np.full(len(start), offsets[level + 1]))
+                child_hi.append(child_lo[-1])
+
+        self.node_start = np.concatenate(starts)
+        self.node_count = np.concatenate(counts)
+        self.node_mass = np.concatenate(masses)
+        self.node_com = np.concatenate(coms)
+        self.node_level = np.concatenate(levels)
+        self.node_prefix = np.concatenate(prefixes)
+        self.node_size = self.size / 2.0 ** self.node_level
+        shift = (2 * (depth - self.node_level)).astype(np.uint64)
+        first = self.keys[self.node_start] >> shift
+        center = np.stack((_compact_bits(first), _compact_bits(first >> np.uint64(1))), axis=1)
+        center = lo + (center + 0.5) * self.node_size[:, np.newaxis]
+        self.node_offset = np.linalg.norm(self.node_com - center, axis=1)
+        self.child_lo = np.concatenate(child_lo)
+        self.child_hi = np.concatenate(child_hi)
+
+    def __len__(self):
+        return len(self.node_mass)
+
+"""
+Spread the low 16 bits of every value so there is a zero bit between each of them
+"""
+def _spread_bits(v):
+    v = v & np.uint64(0xFFFF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x33333333)
+    v = (v | (v << np.uint64(1))) & np.uint64(0x55555555)
+    return v
+
+"""
+Inverse of _spread_bits, gather every other bit back into the low 16 bits
+"""
+def _compact_bits(v):
+    v = v & np.uint64(0x55555555)
+    v = (v | (v >> np.uint64(1))) & np.uint64(0x33333333)
+    v = (v | (v >> np.uint64(2))) & np.uint64(0x0F0F0F0F)
+    v = (v | (v >> np.uint64(4))) & np.uint64(0x00FF00FF)
+    v = (v | (v >> np.uint64(8))) & np.uint64(0x0000FFFF)
+    return v.astype(np.float64)
+
+"""
+Calculate the acceleration on every body by walking the quadtree.
+
+A node is used as a single point mass when it does not contain the body and
+distance > size / theta + offset, which guards against centers of mass sitting near the edge of a node.
+Smaller theta is more accurate, theta = 0 degenerates into direct summation.
+Bodies are walked in blocks of `block` (in Morton order) to bound the memory used by the walk.
+Every interaction is Plummer softened by `softening`, like direct_accelerations() in bodies.py.
+"""
+def accelerations(position, mass, g, theta=0.5, block=2048, softening=0.0):
+    tree = Quadtree(position, mass)
+    n = len(mass)
+    reach = tree.node_size / theta + tree.node_offset if theta > 0 else np.full(len(tree), np.inf)
+    reach2 = reach * reach
+    acc = np.zeros((n, 2))
+
+    for lo in range(0, n, block):
+        hi = min(lo + block, n)
+        pi = np.arange(lo, hi)
+        ni = np.zeros(hi - lo, dtype=np.int64)
+        while pi.size:
+            level = tree.node_level[ni]
+            contains = (tree.keys[pi] >> (2 * (tree.depth - level)).astype(np.uint64)) == tree.node_prefix[ni]
+            leaf = tree.node_count[ni] == 1
+            childless = tree.child_lo[ni] == tree.child_hi[ni]
+
+            com = tree.node_com[ni]
+            node_mass = tree.node_mass[ni]
+            #a childless node that holds this body and others acts through the others' center of mass
+            shared = contains & childless & ~leaf
+            if shared.any():
+                m_self = tree.mass[pi[shared]]
+                rest = node_mass[shared] - m_self
+                safe = np.where(rest > 0, rest, 1.0)
+                com[shared] = (com[shared] * node_mass[shared, np.newaxis] - tree.position[pi[shared]] * m_self[:, np.newaxis]) / safe[:, np.newaxis]
+                node_mass[shared] = np.maximum(rest, 0)
+
+            d = com - tree.position[pi]
+            r2 = np.einsum("ij,ij->i", d, d)
+            accept = (~contains & (leaf | childless | (reach2[ni] < r2))) | shared
+            accept &= r2 > 0
+
+            if accept.any():
+                r2a = r2[accept] + softening * softening
+                w = g * node_mass[accept] / (r2a * np.sqrt(r2a))
+                target = pi[accept] - lo
+                acc[lo:hi, 0] += np.bincount(target, weights=w * d[accept, 0], minlength=hi - lo)
+                acc[lo:hi, 1] += np.bincount(target, weights=w * d[accept, 1], minlength=hi - lo)
+
+            #open every node that was neither used nor a leaf/childless node
+            expand = ~(accept | leaf | childless)
+            counts = tree.child_hi[ni[expand]] - tree.child_lo[ni[expand]]
+            first = np.repeat(tree.child_lo[ni[expand]], counts)
+            run_start = np.repeat(np.cumsum(counts) - counts, counts)
+            ni = first + (np.arange(counts.sum()) - run_start)
+            pi = np.repeat(pi[expand], counts)
+
+    out = np.empty_like(acc)
+    out[tree.order] = acc
+    return out
@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import bodies as sim
+import initial_conditions
+from bodies import ParticleSystem
+from simulation_config import SimulationConfig, DEFAULTS, VALID_METHODS, VALID_SOLVERS, VALID_PRECISIONS, VALID_BACKENDS
+
+"""
+Benchmark suite.
+
+Times every stage of a simulation step separately over a sweep of system sizes, body distributions,
+force solvers, precisions, kernel backends and integrators:
+
+calculate - one force evaluation, calculate()
+update - one integration step with each numerical method, update()
+collisions - collision detection and merging, handle_colision()
+render - drawing one frame of bodies and trails to an offscreen surface
+
+The systems are made by the generators of initial_conditions.py.
+
+Every result records the steps (or frames) per second, the time per pair interaction (counted as
+N^2 pairs per force evaluation, whatever the solver does), the peak memory allocated during one call
+and, for `update`, the relative energy drift and the momentum drift over the timed steps.
+Results are written as JSON so runs can be compared over time:
+
+    python benchmark.py --sizes 100 1000 --output bench.json
+    python benchmark.py --sizes 100 1000 --compare bench.json
+
+With --compare the exit status is 1 if any case got slower than the tolerance allows.
+
+--imports also times a fresh interpreter importing each module in IMPORT_BUDGET, and exits with
+status 1 if any import takes longer than its budget:
+
+    python benchmark.py --imports --stages
+"""
+DISTRIBUTIONS = ["uniform", "keplerian_disk", "plummer"]
+STAGES = ["calculate", "update", "collisions", "render"]
+
+#seconds a fresh interpreter may take to import each module, including numpy.
+#The physics modules must not pull in pygame or read a configuration file.
+IMPORT_BUDGET = {
+    "bodies": 0.2,
+    "headless": 0.2,
+    "gui": 0.4,
+}
+
+#screen size the generated systems are laid out on, matching the default window
+WIDTH, HEIGHT = 1600, 1200
+
+"""
+Generate n bodies with one of the initial_conditions generators, centred on the screen, stored in
+the precision of `config`
+"""
+def generate(distribution, n, g, seed=0, config=DEFAULTS):
+    arrays = initial_conditions.GENERATORS[distribution](n, seed, g, config.mass_stability_scale, center=(WIDTH / 2, HEIGHT / 2))
+    #VER continues from the previous position, as if the bodies had been moving before
+    return ParticleSystem.from_arrays(**arrays, prev=arrays["position"] - arrays["velocity"] * config.dt).convert(config.dtype)
+
+"""
+Median wall time of `repeat` calls of func, after one untimed warm-up call
+"""
+def timed(func, repeat):
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+"""
+Peak memory allocated by one call of func, in bytes
+"""
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+"""
+Wall time of a fresh interpreter importing `module` from this directory, in seconds, best of `repeat`
+"""
+def import_time(module, repeat=3):
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    env = {**os.environ, "PYGAME_HIDE_SUPPORT_PROMPT": "hide"}
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+        times.append(float(result.stdout.split()[-1]))
+    return min(times)
+
+"""
+Import times of the modules in `budget`, as (module, seconds, budget) for every module over its budget
+"""
+def check_imports(budget=IMPORT_BUDGET, report=print):
+    over = []
+    for module, limit in budget.items():
+        seconds = import_time(module)
+        report(f"import {module}: {seconds * 1e3:.1f} ms (budget {limit * 1e3:.0f} ms)")
+        if seconds > limit:
+            over.append((module, seconds, limit))
+    return over
+
+def bench_calculate(bodies, g, repeat, config=DEFAULTS):
+    call = lambda: sim.calculate(bodies, g, config)
+    seconds = timed(call, repeat)
+    return {"seconds": seconds, "steps_per_second": 1 / seconds, "pairs": len(bodies) ** 2, "peak_memory": peak_memory(call)}
+
+def bench_update(bodies, g, dt, steps, config=DEFAULTS):
+    method = sim.INTEGRATORS[config.method]
+    sim.calculate(bodies, g, config)
+    energy0, momentum0 = sim.energy(bodies, g, softening=config.softening), sim.momentum(bodies)
+    #momentum drift is relative to the total absolute momentum, the total itself is often close to zero
+    scale = np.sum(bodies.mass * np.linalg.norm(bodies.velocity, axis=1)) or 1.0
+    start = time.perf_counter()
+    for _ in range(steps):
+        sim.update(bodies, dt, g, config)
+    seconds = (time.perf_counter() - start) / steps
+    energy1, momentum1 = sim.energy(bodies, g, softening=config.softening), sim.momentum(bodies)
+    return {
+        "seconds": seconds,
+        "steps_per_second": 1 / seconds,
+        "pairs": method.force_evaluations * len(bodies) ** 2,
+        "peak_memory": peak_memory(lambda: sim.update(bodies, dt, g, config)),
+        "energy_drift": float(abs(energy1 - energy0) / (abs(energy0) or 1.0)),
+        "momentum_drift": float(np.linalg.norm(momentum1 - momentum0) / scale),
+    }
+
+def bench_collisions(bodies, g, dt, repeat, config=DEFAULTS):
+    #radii large enough for roughly one overlap per body, merging is undone by working on copies
+    rows = np.arange(len(bodies))
+    bodies.radius[:] = 0.5 * np.sqrt(WIDTH * HEIGHT / (np.pi * len(bodies)))
+    sim.calculate(bodies, g, config)
+    copies = [bodies.take(rows) for _ in range(repeat + 2)]
+    merged = []
+    call = lambda: merged.append(sim.handle_colision(copies.pop(), g, dt, config))
+    seconds = timed(call, repeat)
+    return {"seconds": seconds, "steps_per_second": 1 / seconds, "pairs": None, "peak_memory": peak_memory(call), "merged": int(merged[-1])}
+
+def bench_render(bodies, repeat):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "hide")
+    import pygame
+    from gui import BodyRenderer, TrailLayer
+    from tracers import TracerBuffer
+    screen = pygame.Surface((WIDTH, HEIGHT))
+    renderer = BodyRenderer((WIDTH, HEIGHT))
+    trails = TrailLayer((WIDTH, HEIGHT), 1500)
+    tracers = TracerBuffer(bodies.ids, 1500)
+    tracers.append(bodies)
+    def frame():
+        trails.fade_out()
+        if tracers.append(bodies):
+            trails.draw_segments(*tracers.last_segments(), bodies.color)
+        screen.blit(trails.surface, (0, 0))
+        renderer.draw(screen, bodies)
+    seconds = timed(frame, repeat)
+    return {"seconds": seconds, "steps_per_second": 1 / seconds, "pairs": None, "peak_memory": peak_memory(frame)}
+
+"""
+Run every combination of the given sizes, distributions, solvers, precisions, backends and methods.
+Stages that do not depend on the method run once per solver, precision and backend, and render once per size and distribution.
+Compiled kernels are compiled (or loaded from the cache) before anything is timed.
+"""
+def run(sizes, distributions=DISTRIBUTIONS, solvers=("DIRECT",), methods=None, stages=STAGES, steps=10, repeat=5, seed=0, report=print, precisions=("float64",), backends=("numpy",)):
+    methods = VALID_METHODS if methods is None else methods
+    results = []
+    def record(result, **case):
+        result = {**case, **result}
+        result["ns_per_pair"] = result["seconds"] / result["pairs"] * 1e9 if result["pairs"] else None
+        results.append(result)
+        report(describe(result))
+    for n in sizes:
+        for distribution in distributions:
+            for solver in solvers:
+                for precision, backend in ((p, b) for p in precisions for b in backends):
+                    config = SimulationConfig(solver=solver, precision=precision, backend=backend)
+                    g, dt = config.g_scaled, config.dt
+                    compiled = sim.kernels(config)
+                    if compiled is not None:
+                        compiled.warm_up(config.dtype, config.accumulate_dtype)
+                    case = {"solver": solver, "precision": precision, "backend": backend, "distribution": distribution, "n": n}
+                    if "calculate" in stages:
+                        record(bench_calculate(generate(distribution, n, g, seed, config), g, repeat, config), stage="calculate", method=None, **case)
+                    if "update" in stages:
+                        for method in methods:
+                            record(bench_update(generate(distribution, n, g, seed, config), g, dt, steps, config.replace(method=method)), stage="update", method=method, **case)
+                    if "collisions" in stages:
+                        record(bench_collisions(generate(distribution, n, g, seed, config), g, dt, repeat, config), stage="collisions", method=None, **case)
+            if "render" in stages:
+                record(bench_render(generate(distribution, n, DEFAULTS.g_scaled, seed), repeat), stage="render", solver=None, precision=None, backend=None, method=None, distribution=distribution, n=n)
+    return results
+
+"""
+One line summary of a result
+"""
+def describe(result):
+    case = " ".join(str(result[key]) for key in KEY if result.get(key) is not None)
+    line = f"{case}: {result['steps_per_second']:.1f}/s, peak {result['peak_memory'] / 2**20:.1f} MiB"
+    if result["ns_per_pair"] is not None:
+        line += f", {result['ns_per_pair']:.2f} ns/pair"
+    if "energy_drift" in result:
+        line += f", energy drift {result['energy_drift']:.2e}, momentum drift {result['momentum_drift']:.2e}"
+    return line
+
+"""
+Where and with what the benchmarks were run, stored with the results
+"""
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+#fields that identify a case. Results saved before precisions or backends were benchmarked have neither,
+#and compare as float64 and numpy.
+KEY = ("stage", "solver", "precision", "backend", "method", "distribution", "n")
+
+def key(result):
+    case = {name: result.get(name) for name in KEY}
+    if case["precision"] is None and case["stage"] != "render":
+        case["precision"] = "float64"
+    if case["backend"] is None and case["stage"] != "render":
+        case["backend"] = "numpy"
+    return tuple(case.values())
+
+"""
+Compare results against an earlier run. Returns the cases that got slower by more than `tolerance`,
+as (case, old seconds, new seconds).
+"""
+def compare(results, baseline, tolerance=0.2):
+    old = {key(result): result for result in baseline["results"]}
+    slower = []
+    for result in results:
+        previous = old.get(key(result))
+        if previous is not None and result["seconds"] > previous["seconds"] * (1 + tolerance):
+            slower.append((key(result), previous["seconds"], result["seconds"]))
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the N-Body simulation stages")
+    parser.add_argument("-n", "--sizes", type=int, nargs="+", default=[100, 1000, 3000], help="Numbers of bodies to run")
+    parser.add_argument("-d", "--distributions", nargs="+", choices=DISTRIBUTIONS, default=DISTRIBUTIONS, help="Body distributions to run")
+    parser.add_argument("-s", "--solvers", nargs="+", choices=VALID_SOLVERS, default=["DIRECT"], help="Force solvers to run")
+    parser.add_argument("-p", "--precisions", nargs="+", choices=VALID_PRECISIONS, default=["float64"], help="Precisions to run")
+    parser.add_argument("-b", "--backends", nargs="+", choices=VALID_BACKENDS, default=["numpy"], help="Kernel backends to run")
+    parser.add_argument("-m", "--methods", nargs="+", choices=VALID_METHODS, help="Numerical methods to run, every method by default")
+    parser.add_argument("--stages", nargs="*", choices=STAGES, default=STAGES, help="Stages to run")
+    parser.add_argument("--steps", type=int, default=10, help="Integration steps timed per method")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed calls per stage, the median is reported")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated distributions")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare against the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against --compare, as a fraction")
+    parser.add_argument("--imports", action="store_true", help="Check the import time of every module against its budget")
+    args = parser.parse_args(argv)
+
+    status = 0
+    if args.imports:
+        for module, seconds, limit in check_imports():
+            print(f"OVER BUDGET: import {module}: {seconds * 1e3:.1f} ms > {limit * 1e3:.0f} ms")
+            status = 1
+
+    results = run(args.sizes, args.distributions, args.solvers, args.methods, args.stages, args.steps, args.repeat, args.seed, precisions=args.precisions, backends=args.backends)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+        print(f"Wrote {len(results)} results to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        for case, before, after in slower:
+            print(f"SLOWER: {' '.join(str(part) for part in case if part is not None)}: {before * 1e3:.3f} ms -> {after * 1e3:.3f} ms")
+        if slower:
+            return 1
+        print(f"No case slower than {args.tolerance:.0%} against {args.compare}")
+    return status
+
+if __name__ == "__main__":
+    raise SystemExit(main())
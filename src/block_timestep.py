@@ -0,0 +1,129 @@
+import numpy as np
+
+"""
+Adaptive, hierarchical block timestepping.
+
+Instead of one global dt, every body gets a power-of-two fraction of the step, dt_max / 2**level.
+Its level is picked from the acceleration/jerk criterion dt = eta * |a| / |jerk|, so bodies in a
+close encounter take small steps while distant bodies keep taking large ones. eta is the global
+accuracy parameter, smaller values give smaller steps everywhere.
+
+Bodies are advanced with kick-drift-kick leapfrog. All bodies drift together, but forces are only
+recalculated for the bodies whose own step ends at the current substep, so the bodies on coarse
+levels are not paying for the fine ones. A body can only move to a coarser level when the current
+time is a multiple of the coarser step, which keeps every level synchronized at dt_max.
+"""
+class BlockTimestepper:
+    def __init__(self, bodies, g, dt_max, eta=0.02, max_level=8, softening=0.0, budget=None, kernels=None):
+        self.bodies = bodies
+        self.g = g
+        self.softening = softening #Plummer softening length, as in direct_accelerations()
+        self.budget = budget #bytes of pairwise temporaries per tile, as in direct_accelerations()
+        self.kernels = kernels #compiled kernels to sum the forces with (see jit.py), None for NumPy
+        self.dt_max = dt_max
+        self.eta = eta
+        self.max_level = max_level
+        self.ticks = 2 ** max_level #finest substeps per dt_max
+        self.levels = None
+        self.ids = None
+        self.jerk = None
+        self.potential = None #potential energy, from the last evaluation of every body
+        self.time = 0.0
+        self.evaluations = 0 #single-body force evaluations done
+        self.fixed_evaluations = 0 #evaluations a fixed dt run at the smallest step used would have done
+
+    """
+    Acceleration and jerk on the target bodies from every body, by the direct summation kernel.
+    When every body is a target the potential energy is summed in the same sweep.
+    """
+    def _forces(self, targets):
+        #imported here, bodies imports this module
+        import bodies as sim
+        b = self.bodies
+        everyone = len(targets) == len(b)
+        forces = sim.direct_forces if self.kernels is None else self.kernels.direct_forces
+        acc, jerk, potential = forces(b.position, b.mass, self.g, b.velocity, everyone, None if everyone else targets,
+                                      softening=self.softening, budget=self.budget)
+        if everyone:
+            self.potential = potential
+        self.evaluations += len(targets)
+        return acc.astype(b.position.dtype, copy=False), jerk.astype(b.position.dtype, copy=False)
+
+    """
+    Level each body would like from the acceleration/jerk criterion
+    """
+    def _criterion(self, acc, jerk):
+        a = np.linalg.norm(acc, axis=1)
+        j = np.linalg.norm(jerk, axis=1)
+        dt = self.eta * a / np.where(j > 0, j, np.finfo(float).tiny)
+        dt = np.where(j > 0, dt, self.dt_max)
+        level = np.ceil(np.log2(self.dt_max / np.maximum(dt, self.dt_max / self.ticks)))
+        return np.clip(level, 0, self.max_level).astype(np.int64)
+
+    """
+    Levels allowed at substep `tick`: a body may only coarsen to a level whose step starts at this tick
+    """
+    def _aligned(self, level, tick):
+        while True:
+            misaligned = tick % (self.ticks >> level) != 0
+            if not misaligned.any():
+                return level
+            level = np.where(misaligned, level + 1, level)
+
+    """
+    Advance the whole system by dt_max
+    """
+    def step(self):
+        b = self.bodies
+        n = len(b)
+        #bodies were added, removed or merged since the last step, start over from their current state
+        if self.ids is None or len(self.ids) != n or not np.array_equal(self.ids, b.ids):
+            everyone = np.arange(n)
+            b.acceleration, self.jerk = self._forces(everyone)
+            self.levels = self._criterion(b.acceleration, self.jerk)
+            self.ids = b.ids.copy()
+            self.fixed_evaluations += n
+
+        step_ticks = self.ticks >> self.levels
+        deepest = self.levels.max()
+        #opening half kick, after this the velocities are the mid-step ones used for drifting
+        b.velocity += b.acceleration * (self.dt_max / 2 ** self.levels / 2)[:, np.newaxis]
+        next_end = step_ticks.copy()
+        tick = 0
+        tick_dt = self.dt_max / self.ticks
+        while tick < self.ticks:
+            t = next_end.min()
+            b.position += b.velocity * ((t - tick) * tick_dt)
+            tick = t
+            ending = np.flatnonzero(next_end == t)
+            acc, jerk = self._forces(ending)
+            #closing half kick with the old step, opening half kick with the new one
+            b.velocity[ending] += acc * (self.dt_max / 2 ** self.levels[ending] / 2)[:, np.newaxis]
+            b.acceleration[ending] = acc
+            self.jerk[ending] = jerk
+            if tick == self.ticks:
+                break
+            level = self._aligned(self._criterion(acc, jerk), tick)
+            self.levels[ending] = level
+            deepest = max(deepest, level.max())
+            b.velocity[ending] += acc * (self.dt_max / 2 ** level / 2)[:, np.newaxis]
+            next_end[ending] = tick + (self.ticks >> level)
+
+        #every body is synchronized again, let them pick any level for the next step
+        self.levels = self._criterion(b.acceleration, self.jerk)
+        b.prev = b.position - b.velocity * self.dt_max
+        self.time += self.dt_max
+        self.fixed_evaluations += n * 2 ** int(deepest)
+
+    """
+    Force evaluations done so far compared to a fixed dt run at the smallest step that was needed
+    """
+    def report(self):
+        saved = self.fixed_evaluations - self.evaluations
+        return {
+            "evaluations": self.evaluations,
+            "fixed_evaluations": self.fixed_evaluations,
+            "saved": saved,
+            "speedup": self.fixed_evaluations / self.evaluations if self.evaluations else 1.0,
+            "levels": np.bincount(self.levels, minlength=self.max_level + 1) if self.levels is not None else None,
+        }
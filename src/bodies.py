@@ -1,125 +1,583 @@
 import numpy as np
-import json
-
-"""
-List of numerical methods:
-
-CA - constant acceleration
-VER - Verlet integration
-RK4(not yet implemented) - 4th order Runge Kutte method
-"""
-VALID_METHODS = ["CA", "VER", "RK4"]
-METHOD = "VER" #numerical method
-
-#load user-defined configuration
-try:
-    config = json.load(open("simulation_config.json"))
-except:
-    config = {
-    "km_per_pixel" : 200,
-    "mass_stability_scale" : 1e-15,
-    "distance_stability_scale" : 10,
-    "G" : 6.67e-11,
-    "dt" : 2 ,
-    "TRACER" : True,
-    "LOGGING" : False,
-    "bodies" : []
-    }
-    print("ERROR: Could not load simualtion_config.json. Using default parameters instead.")
+import barnes_hut
+import particle_mesh
+import initial_conditions
+from block_timestep import BlockTimestepper
+from integrators import INTEGRATORS
+from profiling import profiler
+from simulation_config import SimulationConfig, DEFAULTS, DEFAULT_CONFIG, VALID_METHODS, VALID_SOLVERS, VALID_PRECISIONS, VALID_BACKENDS, load_config
 
-#Constants for simulation as defined by config json(may change later to only rely on the dictionary read by json)
-km_per_pixel = config["km_per_pixel"] if "km_per_pixel" in config else 200
-m_per_pixel = km_per_pixel * 1000
-mass_stability_scale = config["mass_stability_scale"] if "mass_stability_scale" in config else 1e-15
-distance_stability_scale = config["distance_stability_scale"] if "distance_stability_scale" in config else 10
-G = config["G"] if "G" in config else 6.67e-11 #expressed in m^3/(kg*s^2)
-G_SCALED = G * (m_per_pixel ** 3) * mass_stability_scale
-dt = config["dt"] if "dt" in config else 2#expressed in seconds
-TRACER = config["TRACER"] if "TRACER" in config else True
-LOGGING = config["LOGGING"] if "LOGGING" in config else False
+"""
+Physics of the simulation: the bodies, force calculation, integration and collisions.
 
-#sanity check
-assert METHOD in VALID_METHODS, 'Invalid numerical method given'
+Every function that depends on the settings takes the SimulationConfig to use as its `config`
+argument, and uses the defaults when none is given. Importing this module reads no files.
+"""
 
 """
 Body class. This is the object that represents a body in motion.
 
+A Body is a lightweight view into a ParticleSystem. Its state lives in row `index` of the
+system's arrays, so the GUI and config code can keep working with individual bodies while
+the physics runs on whole arrays. A freshly constructed Body owns a single-row system of its
+own until it is added to a larger one.
+
 TODO:
  - Account for angular momentum/velocity
 """
 class Body:
     def __init__(self, x, y, m, v_x, v_y, color, r):
-        x, y, v_x, v_y, m = float(x), float(y), float(v_x), float(v_y), float(m)
-        self.position = np.array([[x],[y]])
-        self.velocity = np.array([[v_x],[v_y]])
-        self.prev = np.array([[0.0],[0.0]])
-        self.acceleration = np.array([[0.0],[0.0]])
+        self.system = ParticleSystem.empty(1)
+        self.index = 0
+        self.position = (x, y)
+        self.velocity = (v_x, v_y)
         self.mass = m
         self.color = color
         self.radius = r
-        self.tracer = []
-    
+
+    """
+    View of row `index` of an existing system
+    """
+    @classmethod
+    def view(cls, system, index):
+        body = cls.__new__(cls)
+        body.system, body.index = system, index
+        return body
+
+    @property
+    def position(self):
+        return self.system.position[self.index]
+
+    @position.setter
+    def position(self, value):
+        self.system.position[self.index] = np.ravel(value)
+
+    @property
+    def velocity(self):
+        return self.system.velocity[self.index]
+
+    @velocity.setter
+    def velocity(self, value):
+        self.system.velocity[self.index] = np.ravel(value)
+
+    @property
+    def prev(self):
+        return self.system.prev[self.index]
+
+    @prev.setter
+    def prev(self, value):
+        self.system.prev[self.index] = np.ravel(value)
+
+    @property
+    def acceleration(self):
+        return self.system.acceleration[self.index]
+
+    @acceleration.setter
+    def acceleration(self, value):
+        self.system.acceleration[self.index] = np.ravel(value)
+
+    @property
+    def mass(self):
+        return float(self.system.mass[self.index])
+
+    @mass.setter
+    def mass(self, value):
+        self.system.mass[self.index] = value
+
+    @property
+    def radius(self):
+        return float(self.system.radius[self.index])
+
+    @radius.setter
+    def radius(self, value):
+        self.system.radius[self.index] = value
+
+    @property
+    def color(self):
+        return tuple(int(c) for c in self.system.color[self.index])
+
+    @color.setter
+    def color(self, value):
+        self.system.color[self.index] = value
+
     def status(self):
-        return f"pos:{self.position.flatten()}, prev:{self.prev.flatten()}, vel:{self.velocity.flatten()}, acc:{self.acceleration.flatten()}"
+        return f"pos:{self.position}, prev:{self.prev}, vel:{self.velocity}, acc:{self.acceleration}"
+
+"""
+ParticleSystem class. Holds the state of every body in contiguous arrays:
+
+position, velocity, prev, acceleration - N x 2 float arrays, float64 or float32 (see convert())
+mass, radius - N float64 arrays
+color - N x 3 RGB array
+ids - N int array of stable body identifiers
+merges - (removed ids, ids they merged into) array pairs, one per batch of merges, in the order they happened
+jerk, potential - jerk on every body and total potential energy from the last force evaluation, when
+                  it recorded them (see system_accelerations()), otherwise None
+
+Iterating over a system yields its Body views, so it can be used anywhere a list of bodies was.
+Systems built straight from arrays only create their views the first time they are needed.
+"""
+class ParticleSystem:
+    FIELDS = ("position", "velocity", "prev", "acceleration", "mass", "radius", "color", "ids")
+    STATE = ("position", "velocity", "prev", "acceleration")
+
+    def __init__(self, bodies=()):
+        bodies = list(bodies)
+        self._allocate(len(bodies))
+        self.bodies = bodies
+        for i, body in enumerate(bodies):
+            source, j = body.system, body.index
+            self.position[i] = source.position[j]
+            self.velocity[i] = source.velocity[j]
+            self.prev[i] = source.prev[j]
+            self.acceleration[i] = source.acceleration[j]
+            self.mass[i] = source.mass[j]
+            self.radius[i] = source.radius[j]
+            self.color[i] = source.color[j]
+            body.system, body.index = self, i
+
+    @classmethod
+    def empty(cls, n):
+        system = cls.__new__(cls)
+        system._allocate(n)
+        system.bodies = []
+        return system
+
+    def _allocate(self, n):
+        self.position = np.zeros((n, 2))
+        self.velocity = np.zeros((n, 2))
+        self.prev = np.zeros((n, 2))
+        self.acceleration = np.zeros((n, 2))
+        self.mass = np.zeros(n)
+        self.radius = np.zeros(n)
+        self.color = np.zeros((n, 3), dtype=np.uint8)
+        self.ids = np.arange(n)
+        self.timestepper = None
+        self.force_g = None
+        self.merges = []
+        self.jerk = None
+        self.potential = None
+
+    """
+    Build a system around existing arrays without creating any views
+    """
+    @classmethod
+    def from_arrays(cls, position, velocity, mass, radius, color, prev=None, acceleration=None, ids=None):
+        system = cls.empty(0)
+        system.position = np.asarray(position, dtype=np.float64)
+        system.velocity = np.asarray(velocity, dtype=np.float64)
+        system.mass = np.asarray(mass, dtype=np.float64)
+        system.radius = np.asarray(radius, dtype=np.float64)
+        system.color = np.asarray(color, dtype=np.uint8)
+        n = len(system.mass)
+        system.prev = system.position.copy() if prev is None else np.asarray(prev, dtype=np.float64)
+        system.acceleration = np.zeros((n, 2)) if acceleration is None else np.asarray(acceleration, dtype=np.float64)
+        system.ids = np.arange(n) if ids is None else np.asarray(ids, dtype=np.int64)
+        return system
+
+    """
+    Store the state arrays in `dtype`, in place, and return the system.
+    Masses and radii stay float64, they only change when bodies merge.
+    """
+    def convert(self, dtype):
+        for name in self.STATE:
+            setattr(self, name, getattr(self, name).astype(dtype, copy=False))
+        return self
+
+    def __len__(self):
+        return len(self.mass)
+
+    def views(self):
+        if len(self.bodies) != len(self):
+            self.bodies = [Body.view(self, i) for i in range(len(self))]
+        return self.bodies
+
+    def __iter__(self):
+        return iter(list(self.views()))
+
+    def __getitem__(self, i):
+        return self.views()[i]
+
+    """
+    Remove bodies from the system, given either Body views or integer indices.
+    The remaining rows are compacted and every surviving view is re-pointed at its new row.
+    Views of removed bodies keep a copy of their last state.
+    """
+    def remove(self, *targets):
+        drop = [t.index if isinstance(t, Body) else int(t) for t in targets]
+        keep = np.ones(len(self), dtype=bool)
+        keep[drop] = False
+        #systems built straight from arrays have no views to re-point
+        removed = [self.bodies[i] for i in drop] if self.bodies else []
+        for body in removed:
+            body.system, body.index = self.take([body.index]), 0
+        for name in self.FIELDS:
+            setattr(self, name, getattr(self, name)[keep])
+        self.jerk = self.potential = None
+        if self.bodies:
+            self.bodies = [body for i, body in enumerate(self.bodies) if keep[i]]
+            for i, body in enumerate(self.bodies):
+                body.index = i
+        return removed
+
+    """
+    Copy of the given rows as a new system without views
+    """
+    def take(self, rows):
+        system = ParticleSystem.empty(0)
+        for name in self.FIELDS:
+            setattr(system, name, getattr(self, name)[rows])
+        return system
+
+"""
+Default simulation: the Earth with two moons.
+"""
+def default_bodies(config=DEFAULTS):
+    E_TO_M = 384400 #in km
+    mass_stability_scale, km_per_pixel, distance_stability_scale = config.mass_stability_scale, config.km_per_pixel, config.distance_stability_scale
+    earth = Body(400, 300, 5.972 * (10**24) * mass_stability_scale, 0, 0, (0, 0, 255), round(6357/km_per_pixel))
+    moon = Body(400, 300 + round(E_TO_M / km_per_pixel) / distance_stability_scale, 7.348 * (10**22) * mass_stability_scale, 1.022 / distance_stability_scale, 0, (255, 255, 255), round(1738/km_per_pixel))
+    moon2 = Body(400, 300 - round(E_TO_M / km_per_pixel) / distance_stability_scale, 7.348 * (10**23) * mass_stability_scale, 1.522 / distance_stability_scale, 0, (100, 65, 23), round(4738/km_per_pixel))
+    return [earth, moon, moon2]
+
+"""
+Build the system described by the "bodies" entry of a configuration, falling back to default_bodies().
+The entry is an inline list of bodies taking the Body constructor arguments by name
+({"x", "y", "m", "v_x", "v_y", "color", "r"}), a .npz/.npy/.csv file of bodies or a generator,
+see initial_conditions.py. The Verlet history is initialized from the starting velocities.
+`config` is a SimulationConfig or a configuration dictionary.
+"""
+def load_bodies(config, dt=None):
+    if not isinstance(config, SimulationConfig):
+        config = SimulationConfig(config)
+    dt = config.dt if dt is None else dt
+    if config.bodies:
+        system = ParticleSystem.from_arrays(**initial_conditions.load(config.bodies, config.g_scaled, config.mass_stability_scale))
+    else:
+        system = ParticleSystem(default_bodies(config))
+    system.prev = system.position - system.velocity * dt
+    return system.convert(config.dtype)
+
+"""
+Edge length of the square tiles whose `arrays` pairwise temporaries of `itemsize` bytes fit in `budget` bytes
+"""
+def tile_size(budget, itemsize, arrays=4):
+    return max(1, int(np.sqrt(budget / (arrays * itemsize))))
+
+"""
+Pairwise terms of one tile, per unit source mass. fx[i, j], fy[i, j] are the components of the
+acceleration g * d / (r^2 + softening^2)^(3/2), d being the separation from target i to source j.
+The pairs (self_rows[k], self_cols[k]) are a body and itself, and contribute nothing.
+If `velocity` is given as (target velocities, source velocities), jx, jy are the components of the
+jerk, the time derivative of the acceleration, g * (dv - 3 (d.dv) d / r^2) / r^3. If `potential` is
+set, phi[i, j] is g / r, the potential energy of the pair per unit mass of both bodies.
+The terms are computed in `buffers`, four arrays at least as large as the tile and four more for
+the jerk, which are reused from tile to tile instead of allocating new temporaries. Returns
+(fx, fy, jx, jy, phi), the terms that were not asked for being None.
+"""
+def pair_terms(target, source, g, eps2, buffers, self_rows=None, self_cols=None, velocity=None, potential=False):
+    dx, dy, r2, w = (buffer[:len(target), :len(source)] for buffer in buffers[:4])
+    np.subtract(source[np.newaxis, :, 0], target[:, np.newaxis, 0], out=dx)
+    np.subtract(source[np.newaxis, :, 1], target[:, np.newaxis, 1], out=dy)
+    np.multiply(dx, dx, out=r2)
+    np.multiply(dy, dy, out=w)
+    r2 += w
+    if eps2:
+        r2 += eps2
+    if self_rows is not None:
+        r2[self_rows, self_cols] = np.inf
+    jx = jy = None
+    if velocity is not None:
+        jx, jy, rv, t = (buffer[:len(target), :len(source)] for buffer in buffers[4:8])
+        np.subtract(velocity[1][np.newaxis, :, 0], velocity[0][:, np.newaxis, 0], out=jx)
+        np.subtract(velocity[1][np.newaxis, :, 1], velocity[0][:, np.newaxis, 1], out=jy)
+        np.multiply(dx, jx, out=rv)
+        np.multiply(dy, jy, out=t)
+        rv += t
+        rv /= r2
+        rv *= 3
+    np.sqrt(r2, out=w)
+    if potential:
+        #g / r first, then g / r^3 from it in place of r^2, so the potential costs no extra pass
+        np.divide(g, w, out=w)
+        phi, w = w, np.divide(w, r2, out=r2)
+    else:
+        phi = None
+        w *= r2
+        np.divide(g, w, out=w)
+    if velocity is not None:
+        np.multiply(rv, dx, out=t)
+        jx -= t
+        jx *= w
+        np.multiply(rv, dy, out=t)
+        jy -= t
+        jy *= w
+    dx *= w
+    dy *= w
+    return dx, dy, jx, jy, phi
+
+"""
+Direct summation of the gravitational acceleration on every body, and optionally in the same sweep
+the jerk on every body and the total potential energy.
+
+The interactions are processed in tiles of (target block, source block) sized so their temporaries
+stay within `budget` bytes (config.direct_budget by default), so the memory used does not grow with
+N and the tiles stay in cache. When every body is a target, each pair of blocks is visited once and
+its forces applied to both blocks with opposite signs (Newton's third law), halving the work.
+`softening` is the Plummer softening length: separations r are replaced by sqrt(r^2 + softening^2),
+which bounds the force between close bodies.
+The pairwise terms are computed in the type of `position`, and weighted by the masses and summed
+over the sources in `accumulate`, so in mixed precision every sum is in double precision.
+If `targets` is given, only the acceleration on those bodies is calculated. If `rows` is given as
+(start, stop) instead, only the pairs of the bodies in [start, stop) with themselves and the bodies
+after them are summed, still applied to both bodies of every pair, so the results of row ranges that
+cover every body add up to the full result (this is how the parallel solver splits the work).
+The jerk is calculated when `velocity` is given, and the potential energy when `potential` is set,
+which needs every body to be a target. Returns (acceleration, jerk, potential), None for the ones
+that were not asked for.
+"""
+def direct_forces(position, mass, g, velocity=None, potential=False, targets=None, accumulate=None, softening=0.0, budget=None, rows=None):
+    accumulate = position.dtype if accumulate is None else np.dtype(accumulate)
+    arrays = 4 if velocity is None else 8
+    block = tile_size(DEFAULTS.direct_budget if budget is None else budget, position.dtype.itemsize, arrays)
+    n = len(mass)
+    m = mass.astype(accumulate, copy=False)
+    g = position.dtype.type(g)
+    eps2 = position.dtype.type(softening * softening)
+    buffers = np.empty((arrays, block, block), dtype=position.dtype)
+    if velocity is not None:
+        velocity = velocity.astype(position.dtype, copy=False)
+    jerk = None
+    total = 0.0 if potential else None
+    if targets is None:
+        acc = np.zeros((n, 2), dtype=accumulate)
+        if velocity is not None:
+            jerk = np.zeros((n, 2), dtype=accumulate)
+        start, stop = (0, n) if rows is None else rows
+        for lo in range(start, stop, block):
+            hi = min(lo + block, stop)
+            diagonal = np.arange(hi - lo)
+            for source in (lo, *range(hi, n, block)):
+                end = hi if source == lo else min(source + block, n)
+                own = (diagonal, diagonal) if source == lo else (None, None)
+                pair = (velocity[lo:hi], velocity[source:end]) if velocity is not None else None
+                fx, fy, jx, jy, phi = pair_terms(position[lo:hi], position[source:end], g, eps2, buffers, *own, pair, potential)
+                acc[lo:hi, 0] += fx @ m[source:end]
+                acc[lo:hi, 1] += fy @ m[source:end]
+                if jerk is not None:
+                    jerk[lo:hi, 0] += jx @ m[source:end]
+                    jerk[lo:hi, 1] += jy @ m[source:end]
+                if source != lo:
+                    acc[source:end, 0] -= m[lo:hi] @ fx
+                    acc[source:end, 1] -= m[lo:hi] @ fy
+                    if jerk is not None:
+                        jerk[source:end, 0] -= m[lo:hi] @ jx
+                        jerk[source:end, 1] -= m[lo:hi] @ jy
+                if potential:
+                    #a diagonal tile holds every pair in it twice
+                    total -= float(m[lo:hi] @ (phi @ m[source:end])) * (0.5 if source == lo else 1.0)
+        return acc, jerk, total
+
+    if potential:
+        raise ValueError("The potential energy can only be summed with every body as a target")
+    targets = np.asarray(targets)
+    acc = np.zeros((len(targets), 2), dtype=accumulate)
+    if velocity is not None:
+        jerk = np.zeros((len(targets), 2), dtype=accumulate)
+    for lo in range(0, len(targets), block):
+        rows = targets[lo:lo + block]
+        for source in range(0, n, block):
+            end = min(source + block, n)
+            own = np.flatnonzero((rows >= source) & (rows < end))
+            pair = (velocity[rows], velocity[source:end]) if velocity is not None else None
+            fx, fy, jx, jy, _ = pair_terms(position[rows], position[source:end], g, eps2, buffers, own, rows[own] - source, pair)
+            acc[lo:lo + len(rows), 0] += fx @ m[source:end]
+            acc[lo:lo + len(rows), 1] += fy @ m[source:end]
+            if jerk is not None:
+                jerk[lo:lo + len(rows), 0] += jx @ m[source:end]
+                jerk[lo:lo + len(rows), 1] += jy @ m[source:end]
+    return acc, jerk, total
+
+"""
+Acceleration on every body (or the `targets`) by direct summation, see direct_forces()
+"""
+def direct_accelerations(position, mass, g, targets=None, accumulate=None, softening=0.0, budget=None):
+    return direct_forces(position, mass, g, targets=targets, accumulate=accumulate, softening=softening, budget=budget)[0]
+
+"""
+Compiled kernels (the jit module) when config.backend asks for them and Numba is installed, None
+for the NumPy ones. Numba is only imported the first time it is asked for, it takes longer to
+import than everything else.
+"""
+def kernels(config=DEFAULTS):
+    if config.backend != "numba":
+        return None
+    import jit
+    return jit if jit.available() else None
+
+"""
+Accelerations of bodies at the given positions, using the solver selected by config.solver.
+The result has the type of `position`.
+"""
+def accelerations(position, mass, g, config=DEFAULTS):
+    with profiler.phase("forces"):
+        match config.solver:
+            case "DIRECT":
+                compiled = kernels(config)
+                forces = direct_forces if compiled is None else compiled.direct_forces
+                acc = forces(position, mass, g, accumulate=config.accumulate_dtype, softening=config.softening, budget=config.direct_budget)[0]
+            case "BH":
+                acc = barnes_hut.accelerations(position, mass, g, config.theta, softening=config.softening)
+            case "PM":
+                acc = particle_mesh.accelerations(position, mass, g, config.pm_grid, config.pm_cell)
+            case "PAR":
+                #the worker pool is only imported, and started, when it is used
+                import parallel
+                acc = parallel.accelerations(position, mass, g, config.workers, config.softening, config.direct_budget)
+            case _:
+                raise ValueError(f"Invalid force solver {config.solver}")
+        return acc.astype(position.dtype, copy=False)
+
+"""
+Accelerations of the bodies of a system at `position`, see accelerations(). With config.diagnostics
+set and the direct summation solver, the same sweep also leaves the potential energy at those positions
+in bodies.potential, and with config.diagnostics_jerk the jerk on every body in bodies.jerk, using the
+velocities the system holds when it is called. Whatever is not recorded is left None.
+"""
+def system_accelerations(bodies, position, g, config=DEFAULTS):
+    if config.diagnostics and config.solver == "DIRECT":
+        velocity = bodies.velocity if config.diagnostics_jerk else None
+        compiled = kernels(config)
+        forces = direct_forces if compiled is None else compiled.direct_forces
+        with profiler.phase("forces"):
+            acc, bodies.jerk, bodies.potential = forces(position, bodies.mass, g, velocity, True, accumulate=config.accumulate_dtype,
+                                                        softening=config.softening, budget=config.direct_budget)
+        return acc.astype(position.dtype, copy=False)
+    bodies.jerk = bodies.potential = None
+    return accelerations(position, bodies.mass, g, config)
 
 """
-Calculate the net force exerted on every body and change acceleration accordingly
+Calculate the net force exerted on every body and change acceleration accordingly.
+bodies.force_g records the G the accelerations were calculated with, update() recalculates them
+whenever it is None or differs from the G it is given.
 
 TODO:
  - Account for angular momentum/velocity
- - Optimize for computational efficiency
 """
-def calculate(bodies, g):
-    for i, body in enumerate(bodies):
-        F = np.array([[0.0],[0.0]])
-        for j, other in enumerate(bodies):
-            if i != j:
-                pos = other.position - body.position
-                mag = np.linalg.norm(pos)
-                F += g * body.mass * other.mass / mag ** 3 * pos
-        body.acceleration = sanitize_values(F / body.mass)
-        #print("DEBUG: Body", i, body.status())
+def calculate(bodies, g, config=DEFAULTS):
+    bodies.acceleration = system_accelerations(bodies, bodies.position, g, config)
+    bodies.force_g = g
+
+"""
+Compare the Barnes-Hut accelerations against direct summation.
+At most `sample` randomly chosen bodies are checked so the reference stays affordable for large N.
+Returns the max, mean and rms relative error of the acceleration vectors.
+"""
+def force_error(bodies, g, theta=None, sample=1000, seed=0, softening=0.0):
+    theta = DEFAULTS.theta if theta is None else theta
+    approx = barnes_hut.accelerations(bodies.position, bodies.mass, g, theta, softening=softening)
+    targets = np.arange(len(bodies))
+    if len(targets) > sample:
+        targets = np.sort(np.random.default_rng(seed).choice(targets, sample, replace=False))
+    exact = direct_accelerations(bodies.position, bodies.mass, g, targets, softening=softening)
+    norm = np.linalg.norm(exact, axis=1)
+    err = np.linalg.norm(approx[targets] - exact, axis=1) / np.where(norm > 0, norm, 1)
+    return {"max": float(err.max()), "mean": float(err.mean()), "rms": float(np.sqrt(np.mean(err ** 2)))}
+
+"""
+Total potential energy of a system, by direct summation in float64 whatever precision the system is
+stored in. The potential is that of the Plummer softened force for a given `softening` length.
+"""
+def potential_energy(bodies, g, softening=0.0, budget=None):
+    position = bodies.position.astype(np.float64, copy=False)
+    return direct_forces(position, bodies.mass, g, potential=True, softening=softening, budget=budget)[2]
+
+"""
+Total kinetic plus potential energy of a system, computed in float64, see potential_energy()
+"""
+def energy(bodies, g, softening=0.0, budget=None):
+    velocity = bodies.velocity.astype(np.float64, copy=False)
+    kinetic = 0.5 * np.sum(bodies.mass * np.einsum("ij,ij->i", velocity, velocity))
+    return kinetic + potential_energy(bodies, g, softening, budget)
+
+"""
+Energy error of a reduced precision against float64. Copies of at most `sample` randomly chosen
+bodies are advanced `steps` steps with the settings of `config`, once in float64 and once in
+config.precision, without collisions. Returns the relative energy drift of both runs and how many
+times larger the reduced precision drift is.
+"""
+def precision_error(bodies, g, dt, config, steps=20, sample=500, seed=0):
+    rows = np.arange(len(bodies))
+    if len(rows) > sample:
+        rows = np.sort(np.random.default_rng(seed).choice(rows, sample, replace=False))
+    drift = {}
+    for precision in ("float64", config.precision):
+        run = config.replace(precision=precision)
+        system = bodies.take(rows).convert(run.dtype)
+        calculate(system, g, run)
+        start = energy(system, g, softening=run.softening)
+        for _ in range(steps):
+            update(system, dt, g, run)
+        drift[precision] = float(abs(energy(system, g, softening=run.softening) - start) / (abs(start) or 1.0))
+    growth = drift[config.precision] / drift["float64"] if drift["float64"] else float("inf")
+    return {"float64": drift["float64"], config.precision: drift[config.precision], "growth": growth}
+
+"""
+Total linear momentum of a system
+"""
+def momentum(bodies):
+    return bodies.mass @ bodies.velocity
+
+"""
+Conservation diagnostics of a system, a record of plain numbers cheap enough to log every step:
+
+kinetic, potential, energy - kinetic, potential and total energy
+momentum_x, momentum_y - total linear momentum
+angular_momentum - total angular momentum about the origin
+dt_jerk - smallest step eta * |a| / |jerk| of any body, the acceleration/jerk criterion block timesteps
+          use, to compare with dt. None when the jerks were not recorded (config.diagnostics_jerk).
 
+With config.diagnostics set, the potential energy is recorded by the last force evaluation (see
+system_accelerations()) and the record only costs O(N). Otherwise the potential energy takes a
+separate direct summation.
+Everything is computed in float64.
 """
-Update an object's position and velocity based on the changed acceleration calculated by calculate()
+def diagnostics(bodies, g, config=DEFAULTS):
+    position = bodies.position.astype(np.float64, copy=False)
+    velocity = bodies.velocity.astype(np.float64, copy=False)
+    recorded = bodies.potential is not None
+    potential = bodies.potential if recorded else potential_energy(bodies, g, config.softening, config.direct_budget)
+    kinetic = 0.5 * float(bodies.mass @ np.einsum("ij,ij->i", velocity, velocity))
+    momentum = bodies.mass @ velocity
+    dt_jerk = None
+    if recorded and bodies.jerk is not None and len(bodies):
+        a = np.linalg.norm(bodies.acceleration.astype(np.float64), axis=1)
+        j = np.linalg.norm(bodies.jerk.astype(np.float64), axis=1)
+        changing = j > 0
+        dt_jerk = float(config.eta * np.min(a[changing] / j[changing])) if changing.any() else None
+    return {
+        "kinetic": kinetic,
+        "potential": float(potential),
+        "energy": kinetic + float(potential),
+        "momentum_x": float(momentum[0]),
+        "momentum_y": float(momentum[1]),
+        "angular_momentum": float(bodies.mass @ (position[:, 0] * velocity[:, 1] - position[:, 1] * velocity[:, 0])),
+        "dt_jerk": dt_jerk,
+    }
+
+"""
+Advance every body by one step of dt with the integrator selected by config.method.
+The accelerations at the new positions are left in bodies.acceleration for the next step.
 
 TODO:
- - Add RK4 method
  - Account for angular momentum/velocity
 """
-def update(bodies, dt):
-    match METHOD:
-        case "CA":
-            T = np.array([
-                [1, 0, dt, 0],
-                [0, 1, 0, dt],
-                [0, 0, 1, 0],
-                [0, 0, 0, 1]
-            ])
-
-            for body in bodies:
-                state = np.vstack((body.position, body.velocity))
-                a = np.vstack((body.acceleration, body.acceleration)) * dt ** 2 / 2
-                new_state = np.matmul(T, state) + a
-                body.position = new_state[:2]
-                body.velocity = new_state[2:]
-        case "VER":
-            T = np.array([[2, 0, -1, 0, dt**2, 0],
-                         [0, 2, 0, -1, 0, dt**2],
-                         [1, 0, 0, 0, 0, 0],
-                         [0, 1, 0, 0, 0, 0],
-                         [0, 0, 0, 0, 1, 0],
-                         [0, 0, 0, 0, 0, 1]
-                         ])
-            for body in bodies:
-                state = np.vstack((body.position, body.prev))
-                state = np.vstack((state, body.acceleration))
-                new_state = np.matmul(T, state)
-                body.prev = body.position
-                body.position = new_state[:2]
-                body.velocity = (body.position - body.prev) / (2 * dt)
-        case _:
-            print("Invalid numerical method")
+def update(bodies, dt, g=None, config=DEFAULTS):
+    g = config.g_scaled if g is None else g
+    if bodies.force_g != g:
+        calculate(bodies, g, config)
+    INTEGRATORS[config.method](kernels(config)).step(bodies, dt, lambda position: system_accelerations(bodies, position, g, config))
+    bodies.force_g = g
 
 """
 In case of extremely small values, default to 0 to ensure no floating point errors
@@ -128,23 +586,134 @@ def sanitize_values(array, thresh=1e-10):
     return np.where(np.abs(array) < thresh, 0, array)
 
 """
-Check for collisions in the simulation and apply conservation of momentum
+Broad phase collision detection using a spatial hash.
+
+Bodies are binned into square cells as wide as the largest body's diameter, so touching bodies
+always share a cell or sit in neighbouring cells. Each cell is paired with itself and four of its
+neighbours, so every pair of cells is only checked once.
+Returns the index arrays (i, j), i < j, of every pair of overlapping bodies.
+"""
+def find_collisions(position, radius):
+    n = len(radius)
+    none = np.empty(0, dtype=np.int64)
+    if n < 2 or radius.max() <= 0:
+        return none, none
+
+    cell = 2 * radius.max()
+    c = np.floor(position / cell).astype(np.int64)
+    c -= c.min(axis=0)
+    #row stride leaves a gap so the y - 1 neighbour of one column never aliases another column
+    stride = c[:, 1].max() + 3
+    key = c[:, 0] * stride + c[:, 1]
+    order = np.argsort(key, kind="stable")
+    cells, start, count = np.unique(key[order], return_index=True, return_counts=True)
+
+    pairs_i, pairs_j = [], []
+    for ox, oy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+        neighbour = cells + ox * stride + oy
+        b = np.minimum(np.searchsorted(cells, neighbour), len(cells) - 1)
+        a = np.flatnonzero(cells[b] == neighbour)
+        b = b[a]
+        na, nb = count[a], count[b]
+        total = na * nb
+        first = np.cumsum(total) - total
+        local = np.arange(total.sum()) - np.repeat(first, total)
+        ia = np.repeat(start[a], total) + local // np.repeat(nb, total)
+        ib = np.repeat(start[b], total) + local % np.repeat(nb, total)
+        if ox == 0 and oy == 0:
+            keep = ia < ib
+            ia, ib = ia[keep], ib[keep]
+        pairs_i.append(order[ia])
+        pairs_j.append(order[ib])
+
+    i, j = np.concatenate(pairs_i), np.concatenate(pairs_j)
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    d = position[i] - position[j]
+    touching = np.einsum("ij,ij->i", d, d) < (radius[i] + radius[j]) ** 2
+    return i[touching], j[touching]
+
+"""
+Group colliding pairs into clusters of bodies that touch directly or through each other.
+Returns an array giving every body the lowest index in its cluster.
+"""
+def collision_clusters(n, i, j):
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[i], labels[j])
+        new = labels.copy()
+        np.minimum.at(new, i, low)
+        np.minimum.at(new, j, low)
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+"""
+Merge every cluster of colliding bodies into its lowest-indexed body, conserving mass and momentum.
+All clusters are merged in one batch. Returns the number of bodies removed.
+The overlapping pairs are found with the kernels of config.backend.
 
 TODO:
- - Handle multi-body collisions
  - Account for angular momentum
 """
-def handle_colision(body1, body2, bodies, g, dt):
-    dist = np.linalg.norm(body1.position - body2.position)
-    if dist < body1.radius + body2.radius:
-        new_mass = body1.mass + body2.mass
-        new_pos = sanitize_values((body1.position * body1.mass + body2.position * body2.mass) / new_mass)
-        new_vel = sanitize_values((body1.velocity * body1.mass + body2.velocity * body2.mass) / new_mass)
-        body1.position = new_pos
-        body1.velocity = new_vel
-        body1.mass = new_mass
-        body1.radius = int((body1.radius**3 + body2.radius**3)**(1/3))
-        bodies.remove(body2)
-        body1.acceleration = np.zeros_like(body1.acceleration)
-        body1.prev = body1.position - body1.velocity * dt
-        calculate(bodies, g)
\ No newline at end of file
+def merge_collisions(bodies, dt, config=DEFAULTS):
+    compiled = kernels(config)
+    i, j = (find_collisions if compiled is None else compiled.find_collisions)(bodies.position, bodies.radius)
+    if not len(i):
+        return 0
+    n = len(bodies)
+    labels = collision_clusters(n, i, j)
+    survivors = np.unique(labels[np.concatenate((i, j))])
+
+    mass = np.bincount(labels, weights=bodies.mass, minlength=n)[survivors]
+    volume = np.bincount(labels, weights=bodies.radius ** 3, minlength=n)[survivors]
+    moment = np.stack([np.bincount(labels, weights=bodies.mass * bodies.position[:, k], minlength=n)[survivors] for k in range(2)], axis=1)
+    momentum = np.stack([np.bincount(labels, weights=bodies.mass * bodies.velocity[:, k], minlength=n)[survivors] for k in range(2)], axis=1)
+
+    bodies.position[survivors] = sanitize_values(moment / mass[:, np.newaxis])
+    bodies.velocity[survivors] = sanitize_values(momentum / mass[:, np.newaxis])
+    bodies.mass[survivors] = mass
+    bodies.radius[survivors] = np.floor(np.cbrt(volume))
+    bodies.acceleration[survivors] = 0
+    bodies.prev[survivors] = bodies.position[survivors] - bodies.velocity[survivors] * dt
+
+    removed = np.flatnonzero(labels != np.arange(n))
+    bodies.merges.append((bodies.ids[removed], bodies.ids[labels[removed]]))
+    bodies.remove(*removed)
+    return len(removed)
+
+"""
+Check for collisions in the simulation and apply conservation of momentum.
+Forces are recalculated once after all collisions in the step have been merged.
+Returns the number of bodies removed.
+
+TODO:
+ - Account for angular momentum
+"""
+def handle_colision(bodies, g, dt, config=DEFAULTS):
+    merged = merge_collisions(bodies, dt, config)
+    if merged:
+        calculate(bodies, g, config)
+    return merged
+
+"""
+Advance the simulation by one step: forces, integration, then collisions.
+The profiler times the "integrate" phase, which includes the "forces" phases inside it, and "collisions".
+With config.adaptive set, the forces and integration are done by the system's BlockTimestepper instead,
+using dt as the largest block step.
+"""
+def step(bodies, g, dt, config=DEFAULTS):
+    with profiler.phase("integrate"):
+        if config.adaptive:
+            if bodies.timestepper is None:
+                bodies.timestepper = BlockTimestepper(bodies, g, dt, config.eta, config.max_level, config.softening, config.direct_budget, kernels(config))
+            bodies.timestepper.g, bodies.timestepper.dt_max = g, dt
+            bodies.timestepper.step()
+            #the block timestepper always uses direct summation, and ends on a force evaluation of every body
+            bodies.force_g = None
+            if config.diagnostics:
+                bodies.jerk, bodies.potential = bodies.timestepper.jerk, bodies.timestepper.potential
+        else:
+            update(bodies, dt, g, config)
+    with profiler.phase("collisions"):
+        handle_colision(bodies, g, dt, config)
@@ -0,0 +1,146 @@
+import numpy as np
+from bodies import collision_clusters
+
+"""
+Ensemble mode. Integrates M independent systems of N bodies at once.
+
+Every member's state is stacked into (M, N, 2) position/velocity arrays and (M, N) mass/radius
+arrays, so one batched force pass and one batched update advance every member together.
+Each member has its own G and dt, which makes parameter sweeps over the same knobs as the
+G and dt sliders a single array computation.
+
+Members are advanced with kick-drift-kick leapfrog, which follows the same trajectories as the
+VER method but keeps the velocities in step with the positions for the energy diagnostics.
+Gravity is Plummer softened by `softening` like the direct summation solver, so a replicated
+system follows the same dynamics as the run it was copied from when given config.softening.
+Colliding bodies are merged the same way as handle_colision(): every cluster of touching bodies,
+including bodies that only touch through another one, merges into its lowest-indexed body, which
+takes the combined mass and momentum. The others are deactivated (zero mass and radius), so the
+arrays keep their shape.
+"""
+class Ensemble:
+    def __init__(self, position, velocity, mass, radius, g, dt, softening=0.0):
+        self.position = np.array(position, dtype=np.float64)
+        self.velocity = np.array(velocity, dtype=np.float64)
+        m, n = self.position.shape[:2]
+        self.mass = np.array(np.broadcast_to(mass, (m, n)), dtype=np.float64)
+        self.radius = np.array(np.broadcast_to(radius, (m, n)), dtype=np.float64)
+        self.g = np.array(np.broadcast_to(g, (m,)), dtype=np.float64)
+        self.dt = np.array(np.broadcast_to(dt, (m,)), dtype=np.float64)
+        self.eps2 = float(softening) ** 2
+        self.active = self.mass > 0
+        self.steps = 0
+        self.collisions = np.zeros(m, dtype=np.int64)
+        self.acceleration, _ = self._forces()
+        self.energy0 = self.energy()
+
+    """
+    Stack M copies of a ParticleSystem, one for each entry of g and dt (either may be a scalar)
+    """
+    @classmethod
+    def replicate(cls, bodies, g, dt, softening=0.0):
+        m = np.broadcast(np.asarray(g), np.asarray(dt)).size
+        stack = lambda a: np.repeat(a[np.newaxis], m, axis=0)
+        return cls(stack(bodies.position), stack(bodies.velocity), stack(bodies.mass), stack(bodies.radius), g, dt, softening)
+
+    def __len__(self):
+        return len(self.g)
+
+    """
+    Separation vectors d[m, i, j] from body i to body j and squared distances r2[m, i, j].
+    Pairs involving the same or an inactive body are at infinite distance.
+    """
+    def _pairwise(self):
+        d = self.position[:, np.newaxis, :, :] - self.position[:, :, np.newaxis, :]
+        r2 = np.einsum("mijk,mijk->mij", d, d)
+        idx = np.arange(r2.shape[1])
+        r2[:, idx, idx] = np.inf
+        both = self.active[:, np.newaxis, :] & self.active[:, :, np.newaxis]
+        r2[~both] = np.inf
+        return d, r2
+
+    """
+    Batched direct summation over every member, also returning the unsoftened squared distances for
+    collision checks
+    """
+    def _forces(self):
+        d, r2 = self._pairwise()
+        soft = r2 + self.eps2
+        w = self.g[:, np.newaxis, np.newaxis] * self.mass[:, np.newaxis, :] / (soft * np.sqrt(soft))
+        return np.einsum("mij,mijk->mik", w, d), r2
+
+    """
+    Merge every cluster of touching bodies into its lowest-indexed body, conserving mass and momentum,
+    in one batch over every member. Bodies are numbered across members (member * N + body), so the
+    clusters of different members never join. Returns whether anything was merged.
+    """
+    def _merge(self, r2):
+        touching = r2 < (self.radius[:, :, np.newaxis] + self.radius[:, np.newaxis, :]) ** 2
+        m, i, j = np.nonzero(np.triu(touching, 1))
+        if not len(m):
+            return False
+        members, n = self.mass.shape
+        i, j = m * n + i, m * n + j
+        labels = collision_clusters(members * n, i, j)
+        survivors = np.unique(labels[np.concatenate((i, j))])
+
+        weights = lambda values: np.bincount(labels, weights=values.reshape(-1), minlength=members * n)[survivors]
+        mass = weights(self.mass)
+        moment = np.stack([weights(self.mass * self.position[..., k]) for k in range(2)], axis=1)
+        momentum = np.stack([weights(self.mass * self.velocity[..., k]) for k in range(2)], axis=1)
+        volume = weights(self.radius ** 3)
+
+        kept = np.divmod(survivors, n)
+        self.position[kept] = moment / mass[:, np.newaxis]
+        self.velocity[kept] = momentum / mass[:, np.newaxis]
+        self.mass[kept] = mass
+        self.radius[kept] = np.floor(np.cbrt(volume))
+        removed = np.flatnonzero(labels != np.arange(members * n))
+        gone = np.divmod(removed, n)
+        self.mass[gone] = self.radius[gone] = 0
+        self.velocity[gone] = 0
+        self.active[gone] = False
+        self.collisions += np.bincount(gone[0], minlength=members)
+        return True
+
+    """
+    Advance every member by one kick-drift-kick step of its own dt
+    """
+    def step(self):
+        half = (self.dt / 2)[:, np.newaxis, np.newaxis]
+        self.velocity += self.acceleration * half
+        self.position += self.velocity * (2 * half)
+        self.acceleration, r2 = self._forces()
+        if self._merge(r2):
+            self.acceleration, _ = self._forces()
+        self.velocity += self.acceleration * half
+        self.steps += 1
+
+    def run(self, steps):
+        for _ in range(steps):
+            self.step()
+        return self.diagnostics()
+
+    """
+    Total energy of every member
+    """
+    def energy(self):
+        kinetic = 0.5 * np.einsum("mi,mik,mik->m", self.mass, self.velocity, self.velocity)
+        _, r2 = self._pairwise()
+        potential = -0.5 * np.einsum("m,mi,mj,mij->m", self.g, self.mass, self.mass, 1 / np.sqrt(r2 + self.eps2))
+        return kinetic + potential
+
+    """
+    Per-member diagnostics: relative energy drift since the start, collisions so far and bodies left
+    """
+    def diagnostics(self):
+        energy = self.energy()
+        scale = np.where(self.energy0 != 0, np.abs(self.energy0), 1)
+        return {
+            "steps": self.steps,
+            "time": self.steps * self.dt,
+            "energy": energy,
+            "energy_drift": (energy - self.energy0) / scale,
+            "collisions": self.collisions.copy(),
+            "bodies": self.active.sum(axis=1),
+        }
@@ -1,3 +1,4 @@
+import time
 import pygame
 import numpy as np
 
@@ -18,10 +19,18 @@ BUTTON_COLOR = BLUE
 SLIDER_COLOR = DARK_GRAY
 SLIDER_BG_COLOR = WHITE
 
-#initialize all GUI elements
-pygame.init()
-pygame.font.init()
-font = pygame.font.SysFont(None, 24)
+#GUI font, loaded on first use so importing this module does not initialize pygame
+_font = None
+
+"""
+Font shared by every GUI element. The caller must have called pygame.init().
+"""
+def get_font():
+    global _font
+    if _font is None:
+        pygame.font.init()
+        _font = pygame.font.SysFont(None, 24)
+    return _font
 
 #Slider class to handle user interaction
 class Slider:
@@ -37,12 +46,16 @@ class Slider:
         self.handle_rect = pygame.Rect(x + (value - min_val) / (max_val - min_val) * 150 - 5, y - 5, 10, 20)
         self.is_dragging = False
         self.parent = parent
+        self.label_text = Label(self.x - 30, self.y - 20, parent)
     def draw(self):
         pygame.draw.rect(self.parent, SLIDER_BG_COLOR, self.slider_rect)  # Slider background
         pygame.draw.rect(self.parent, SLIDER_COLOR, self.handle_rect)  # Slider handle
-        # Draw the label and value
-        label_text = font.render(f"{self.label}: {self.value:.2e}", True, BLACK)
-        self.parent.blit(label_text, (self.x - 30, self.y - 20))
+        # Draw the label and value, only rendered again when the value changes
+        self.label_text.draw(f"{self.label}: {self.value:.2e}")
+
+    def set_value(self, value):
+        self.value = np.clip(value, self.min_val, self.max_val)
+        self.handle_rect.x = self.x + (self.value - self.min_val) / (self.max_val - self.min_val) * 150 - 5
 
     def update(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN:
@@ -57,12 +70,34 @@ class Slider:
                 self.value = np.clip(new_value, self.min_val, self.max_val)
                 self.handle_rect.x = self.x + (self.value - self.min_val) / (self.max_val - self.min_val) * 150 - 5
 
+#Line of text that keeps its rendered surface until the text changes
+class Label:
+    def __init__(self, x, y, parent, color=BLACK):
+        self.x = x
+        self.y = y
+        self.parent = parent
+        self.color = color
+        self.text = None
+        self.surface = None
+
+    def draw(self, text):
+        if text != self.text:
+            self.text = text
+            self.surface = get_font().render(text, True, self.color)
+        self.parent.blit(self.surface, (self.x, self.y))
+
+#the sidebar background and title never change, so they are rendered once per height
+sidebar_cache = {}
+
 def draw_sidebar(screen, height):
-    pygame.draw.rect(screen, SIDEBAR_COLOR, (0, 0, SIDEBAR_WIDTH, height))
-    
-    # Title text
-    title_text = font.render("Simulation Controls", True, BLACK)
-    screen.blit(title_text, (20, 20))
+    if height not in sidebar_cache:
+        sidebar = pygame.Surface((SIDEBAR_WIDTH, height))
+        sidebar.fill(SIDEBAR_COLOR)
+        # Title text
+        title_text = get_font().render("Simulation Controls", True, BLACK)
+        sidebar.blit(title_text, (20, 20))
+        sidebar_cache[height] = sidebar
+    screen.blit(sidebar_cache[height], (0, 0))
 
 #Button class to handle user interaction
 class Button:
@@ -70,18 +105,206 @@ class Button:
         self.label = label
         self.rect = pygame.Rect(x, y, width, height)
         self.parent = parent
+        #the button never changes, render it once
+        self.surface = pygame.Surface(self.rect.size)
+        self.surface.fill(BUTTON_COLOR)  # Button background
+        button_text = get_font().render(self.label, True, WHITE)
+        self.surface.blit(button_text, ((self.rect.width - button_text.get_width()) // 2,
+                                        (self.rect.height - button_text.get_height()) // 2))
 
     def draw(self):
-        screen = self.parent
-        pygame.draw.rect(screen, BUTTON_COLOR, self.rect)  # Button background
-        button_text = font.render(self.label, True, WHITE)
-        screen.blit(button_text, (self.rect.x + (self.rect.width - button_text.get_width()) // 2,
-                                  self.rect.y + (self.rect.height - button_text.get_height()) // 2))
+        self.parent.blit(self.surface, self.rect)
 
     def check_click(self, event, func):
         if event.type == pygame.MOUSEBUTTONDOWN and self.rect.collidepoint(event.pos):
             func()
 
+#Persistent surface the tracer trails are drawn onto. Rather than redrawing every trail each frame,
+#the surface is darkened a little every frame and only the newest segment of each trail is added,
+#so old points fade out over `lifetime` frames.
+#Darkening blits translucent black, which is far faster than a multiplying fill. Alphas below 16 are
+#too coarse in 8 bits, so long lifetimes darken every `period` frames with a stronger alpha instead.
+class TrailLayer:
+    def __init__(self, size, lifetime):
+        self.surface = pygame.Surface(size)
+        factor = 255 ** (-1 / max(lifetime, 1)) #brightness kept per frame
+        self.period = 1
+        while 255 * (1 - factor ** self.period) < 16 and self.period < lifetime:
+            self.period += 1
+        self.shade = pygame.Surface(size)
+        self.shade.fill(BLACK)
+        self.shade.set_alpha(max(1, round(255 * (1 - factor ** self.period))))
+        self.frames = 0
+
+    def clear(self):
+        self.surface.fill(BLACK)
+
+    def fade_out(self):
+        self.frames += 1
+        if self.frames % self.period == 0:
+            self.surface.blit(self.shade, (0, 0))
+
+    def draw_segments(self, before, latest, valid, colors, width=2):
+        #skip segments that end outside the surface
+        w, h = self.surface.get_size()
+        valid = valid & (latest[:, 0] >= 0) & (latest[:, 0] < w) & (latest[:, 1] >= 0) & (latest[:, 1] < h)
+        for start, end, color in zip(before[valid].tolist(), latest[valid].tolist(), colors[valid].tolist()):
+            pygame.draw.line(self.surface, color, start, end, width)
+
+    #fade the trails, add the newest segments after appending `system` to `tracers`, and draw them onto screen
+    def update(self, screen, tracers, system):
+        self.fade_out()
+        if tracers.append(system):
+            self.draw_segments(*tracers.last_segments(), system.color)
+        screen.blit(self.surface, (0, 0))
+
+#Sidebar table of the profiled phases, mean and 95th percentile in milliseconds.
+#The numbers are refreshed every `interval` seconds so they stay readable and cheap to draw.
+class ProfileOverlay:
+    def __init__(self, x, y, parent, profiler, rows=10, interval=0.5):
+        self.profiler = profiler
+        self.interval = interval
+        self.title = Label(x, y, parent)
+        self.rows = [Label(x, y + 20 * (i + 1), parent) for i in range(rows)]
+        self.lines = []
+        self.refreshed = 0.0
+        self.visible = True
+
+    def draw(self):
+        if not self.visible:
+            return
+        now = time.perf_counter()
+        if now - self.refreshed >= self.interval:
+            self.refreshed = now
+            stats = self.profiler.stats()
+            self.lines = [f"{name}: {row['mean'] * 1e3:.2f} / {row['p95'] * 1e3:.2f}" for name, row in stats.items()]
+        self.title.draw("Phase: mean / p95 ms")
+        for label, line in zip(self.rows, self.lines):
+            label.draw(line)
+
+#Key for the velocity and acceleration vectors, rendered once
+class Legend:
+    def __init__(self, entries):
+        self.surface = pygame.Surface((160, 20 * len(entries) + 5), pygame.SRCALPHA)
+        for i, (label, color) in enumerate(entries):
+            draw_vector(self.surface, (0, 10 + 20 * i), np.array([30.0, 0.0]), color)
+            self.surface.blit(get_font().render(label, True, color), (45, 5 + 20 * i))
+
+    def draw(self, screen, position):
+        screen.blit(self.surface, position)
+
+#Sidebar and frame layout shared by the simulation window and the server viewer: the G and dt sliders,
+#Start/Stop and Reset, the simulation speed, the profiler table when a profiler is given, the bodies
+#and the vector key. Whatever the buttons do is passed to update() by the window.
+class ControlPanel:
+    def __init__(self, screen, g, dt, profiler=None):
+        self.screen = screen
+        self.size = screen.get_size()
+        self.g_slider = Slider("G", g, 40, 60, 0, 1e-9, 1e-11, screen)
+        self.dt_slider = Slider("dt", dt, 40, 120, 1, 10, 0.010, screen)
+        self.start_stop_button = Button("Start/Stop", 50, 180, 100, 40, screen)
+        self.reset_button = Button("Reset", 50, 240, 100, 40, screen)
+        self.speed_label = Label(20, 300, screen)
+        self.steps_label = Label(20, 325, screen)
+        self.time_label = Label(20, 350, screen)
+        self.bodies_label = Label(20, 375, screen)
+        self.overlay = ProfileOverlay(10, 410, screen, profiler) if profiler is not None else None
+        self.legend = Legend([("Velocity", RED), ("Acceleration", GREEN)])
+        self.renderer = BodyRenderer(self.size)
+
+    def update(self, event, start_stop, reset):
+        self.g_slider.update(event)
+        self.dt_slider.update(event)
+        self.start_stop_button.check_click(event, start_stop)
+        self.reset_button.check_click(event, reset)
+
+    def set_values(self, g, dt):
+        self.g_slider.set_value(g)
+        self.dt_slider.set_value(dt)
+
+    #draw the sidebar controls, the simulation speed (a runner.SpeedMeter) and the bodies
+    def draw(self, system, speed, sim_time):
+        width, height = self.size
+        draw_sidebar(self.screen, height)
+        self.g_slider.draw()
+        self.dt_slider.draw()
+        self.start_stop_button.draw()
+        self.reset_button.draw()
+        self.speed_label.draw(f"Speed: {speed.ratio:.1f}x")
+        self.steps_label.draw(f"Steps/s: {speed.steps_per_second:.0f}")
+        self.time_label.draw(f"Time: {sim_time:.0f} s")
+        if self.overlay is not None and self.overlay.profiler.enabled:
+            self.overlay.draw()
+        visible = self.renderer.draw(self.screen, system)
+        self.bodies_label.draw(f"Bodies: {visible}/{len(system)}")
+        self.legend.draw(self.screen, (width - 160, 0))
+
+"""
+Draws every body of a system in a few vectorized passes.
+
+Bodies outside the viewport are culled. Bodies with a radius of at most `splat_radius` pixels are
+written straight into the screen's pixel array through pygame.surfarray, one small disc stencil per
+radius for all of them at once, and only the few larger bodies are drawn as circles one by one.
+Bodies smaller than a pixel still show up as a single pixel. Velocity and acceleration vectors are
+only drawn when at most `vector_limit` bodies are visible, since thousands of arrows are unreadable.
+"""
+class BodyRenderer:
+    def __init__(self, size, splat_radius=2, vector_limit=100):
+        self.size = size
+        self.splat_radius = splat_radius
+        self.vector_limit = vector_limit
+        #pixel offsets covered by a disc of each splatted radius
+        self.stencils = []
+        for r in range(splat_radius + 1):
+            dx, dy = np.mgrid[-r:r + 1, -r:r + 1]
+            inside = dx ** 2 + dy ** 2 <= r ** 2 + r
+            self.stencils.append((dx[inside], dy[inside]))
+
+    """
+    Indices of the bodies that overlap the viewport
+    """
+    def visible(self, position, radius):
+        width, height = self.size
+        x, y = position[:, 0], position[:, 1]
+        return np.flatnonzero((x + radius >= 0) & (x - radius < width) & (y + radius >= 0) & (y - radius < height))
+
+    def draw(self, screen, system, velocity_scale=1000, acceleration_scale=1e6):
+        visible = self.visible(system.position, system.radius)
+        radius = system.radius[visible]
+        small = radius <= self.splat_radius
+        self.splat(screen, system.position[visible[small]], radius[small], system.color[visible[small]])
+        for i in visible[~small]:
+            pygame.draw.circle(screen, tuple(system.color[i].tolist()), system.position[i].astype(int).tolist(), system.radius[i])
+        if len(visible) <= self.vector_limit:
+            for i in visible:
+                origin = system.position[i].astype(int).tolist()
+                #in float64, pygame does not take float32 scalars
+                draw_vector(screen, origin, system.velocity[i].astype(np.float64), RED, velocity_scale)
+                draw_vector(screen, origin, system.acceleration[i].astype(np.float64), GREEN, acceleration_scale)
+        return len(visible)
+
+    def splat(self, screen, position, radius, color):
+        if len(position) == 0:
+            return
+        width, height = screen.get_size()
+        x = position[:, 0].astype(np.int64)
+        y = position[:, 1].astype(np.int64)
+        r = np.rint(radius).astype(np.int64)
+        pixels = pygame.surfarray.pixels3d(screen)
+        try:
+            for size, (dx, dy) in enumerate(self.stencils):
+                group = np.flatnonzero(r == size)
+                if len(group) == 0:
+                    continue
+                px = (x[group, np.newaxis] + dx).ravel()
+                py = (y[group, np.newaxis] + dy).ravel()
+                c = np.repeat(color[group], len(dx), axis=0)
+                inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+                pixels[px[inside], py[inside]] = c[inside]
+        finally:
+            #the screen stays locked while the pixel array exists
+            del pixels
+
 #Nice vector graphics
 def draw_vector(surface, origin, vector, color, scale=1, width=2):
     scaled_vector = scale * vector
@@ -0,0 +1,188 @@
+import argparse
+import os
+import time
+import numpy as np
+import bodies as sim
+from simulation_config import SimulationConfig, VALID_METHODS, VALID_PRECISIONS
+from trajectory import TrajectoryWriter
+from checkpoint import save_checkpoint, load_checkpoint
+from profiling import profiler, enable, VERBOSITY
+
+"""
+Headless simulation runner.
+
+Runs a configuration without pygame or a display, as fast as the hardware allows, and emits
+snapshots of the system every `every` steps. Usable from Python:
+
+    for snap in run("simulation_config.json", steps=10000, every=100):
+        ...
+
+or from the command line:
+
+    python headless.py --config simulation_config.json --steps 10000 --every 100 --output run.npz
+"""
+
+"""
+Copy of the state of the system at one point in time
+"""
+def snapshot(bodies, step, t):
+    return {
+        "step": step,
+        "time": t,
+        "ids": bodies.ids.copy(),
+        "position": bodies.position.copy(),
+        "velocity": bodies.velocity.copy(),
+        "mass": bodies.mass.copy(),
+    }
+
+"""
+Advance `bodies` for a number of steps or until `duration` seconds of simulated time have passed,
+yielding a snapshot every `every` steps. The starting state is always the first snapshot and the
+final state is always the last one. Every step is also offered to `log`, a TrajectoryWriter, if given.
+`start` and `start_time` are the step counter and simulated time to continue from, after a restore.
+If `checkpoint` is given, it is called with the step counter and simulated time every `checkpoint_every` steps.
+If `monitor` is given, it is called with the step counter, simulated time and the conservation
+diagnostics record (see bodies.diagnostics()) of the starting state and after every step.
+The solver, method and other settings come from `config`, a SimulationConfig.
+"""
+def simulate(bodies, g, dt, steps=None, duration=None, every=1, log=None, start=0, start_time=0.0, checkpoint=None, checkpoint_every=None, config=sim.DEFAULTS, monitor=None):
+    if steps is None and duration is None:
+        raise ValueError("Either steps or duration must be given")
+    if steps is None:
+        steps = int(np.ceil(duration / dt))
+    if log is not None:
+        log.append(bodies, start, start_time)
+    if monitor is not None:
+        #forces at the start, so the first record comes from a force evaluation like the others
+        if bodies.potential is None:
+            sim.calculate(bodies, g, config)
+        monitor(start, start_time, sim.diagnostics(bodies, g, config))
+    yield snapshot(bodies, start, start_time)
+    for n in range(1, steps + 1):
+        sim.step(bodies, g, dt, config)
+        if log is not None:
+            log.append(bodies, start + n, start_time + n * dt)
+        if monitor is not None:
+            monitor(start + n, start_time + n * dt, sim.diagnostics(bodies, g, config))
+        if checkpoint is not None and n % checkpoint_every == 0:
+            checkpoint(start + n, start_time + n * dt)
+        if n % every == 0 or n == steps:
+            yield snapshot(bodies, start + n, start_time + n * dt)
+
+"""
+Load a configuration file and simulate it, see simulate()
+"""
+def run(config_path="simulation_config.json", steps=None, duration=None, every=1, method=None):
+    config = SimulationConfig.load(config_path)
+    if method:
+        config = config.replace(method=method)
+    bodies = sim.load_bodies(config)
+    yield from simulate(bodies, config.g_scaled, config.dt, steps, duration, every, config=config)
+
+"""
+Save a list of snapshots to a .npz file. The number of bodies can change between snapshots when
+bodies merge, so each snapshot's arrays are stored under their own "<field>_<index>" keys.
+"""
+def save_snapshots(path, snapshots):
+    arrays = {}
+    for i, snap in enumerate(snapshots):
+        for key, value in snap.items():
+            arrays[f"{key}_{i}"] = np.asarray(value)
+    np.savez(path, count=len(snapshots), **arrays)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an N-Body simulation without a display")
+    parser.add_argument("-c", "--config", default="simulation_config.json", help="Path to the simulation config")
+    length = parser.add_mutually_exclusive_group(required=True)
+    length.add_argument("-n", "--steps", type=int, help="Number of steps to simulate")
+    length.add_argument("-t", "--time", type=float, help="Simulated time to run for, in seconds")
+    parser.add_argument("-e", "--every", type=int, default=1, help="Emit a snapshot every N steps")
+    parser.add_argument("-o", "--output", help="Save the snapshots to this .npz file")
+    parser.add_argument("-m", "--method", choices=VALID_METHODS, help="Numerical method, overrides the config")
+    parser.add_argument("-p", "--precision", choices=VALID_PRECISIONS, help="Precision of the positions, velocities and forces, overrides the config")
+    parser.add_argument("-r", "--restore", help="Continue from a checkpoint file instead of the configured bodies")
+    parser.add_argument("--checkpoint-every", type=int, help="Save a checkpoint every N steps")
+    parser.add_argument("-d", "--diagnostics", help="Write the energy, momentum and angular momentum after every step to this .csv file, recorded during the force calculation")
+    parser.add_argument("--jerk", action="store_true", help="With --diagnostics, also record the jerks and the timestep they call for")
+    parser.add_argument("-v", "--verbosity", choices=VERBOSITY, default="LOW", help="MED times every phase of a step, HIGH also runs the sampling profiler")
+    parser.add_argument("--profile-output", help="Save the phase timings to this .csv or .json file")
+    parser.add_argument("--samples-output", help="Save the sampled stacks (HIGH verbosity) to this file, in collapsed flame graph format")
+    args = parser.parse_args(argv)
+
+    config = SimulationConfig.load(args.config)
+    start, start_time = 0, 0.0
+    if args.restore:
+        bodies, state = load_checkpoint(args.restore)
+        config = config.replace(G=state["G"], dt=state["dt"], method=state["method"])
+        start, start_time = state["step"], state["time"]
+    if args.method:
+        config = config.replace(method=args.method)
+    if args.precision:
+        config = config.replace(precision=args.precision)
+    if args.diagnostics:
+        config = config.replace(diagnostics=True, diagnostics_jerk=args.jerk or config.diagnostics_jerk)
+    if args.restore:
+        bodies.convert(config.dtype)
+    else:
+        bodies = sim.load_bodies(config)
+    if config.precision != "float64":
+        print(f"Precision {config.precision}, relative energy drift against float64: {sim.precision_error(bodies, config.g_scaled, config.dt, config)}")
+
+    #a restored run continues its log from the restored step
+    log = TrajectoryWriter(config.log_path, len(bodies), config.log_stride, metadata={"dt": config.dt, "method": config.method},
+                           resume=start if args.restore else None) if config.logging else None
+
+    def checkpoint(step, t):
+        os.makedirs(config.checkpoint_dir, exist_ok=True)
+        path = save_checkpoint(os.path.join(config.checkpoint_dir, f"checkpoint_{step}.npz"), bodies, config.G, config.g_scaled, config.dt, config.method, step, t)
+        print(f"Saved checkpoint {path}")
+
+    #one line per step, with the drifts since the start so a run can be checked without the first line
+    diagnostics = open(args.diagnostics, "w") if args.diagnostics else None
+    first_record = None
+    def monitor(step, t, record):
+        nonlocal first_record
+        if first_record is None:
+            first_record = record
+            diagnostics.write(",".join(["step", "time", *record, "energy_drift", "angular_momentum_drift"]) + "\n")
+        energy_drift = (record["energy"] - first_record["energy"]) / (abs(first_record["energy"]) or 1.0)
+        angular_drift = (record["angular_momentum"] - first_record["angular_momentum"]) / (abs(first_record["angular_momentum"]) or 1.0)
+        values = [step, t, *("" if value is None else value for value in record.values()), energy_drift, angular_drift]
+        diagnostics.write(",".join(f"{value:.10g}" if isinstance(value, float) else str(value) for value in values) + "\n")
+
+    sampler = enable(args.verbosity)
+    first = time.perf_counter()
+    snapshots = []
+    for snap in simulate(bodies, config.g_scaled, config.dt, args.steps, args.time, args.every, log, start, start_time,
+                         checkpoint if args.checkpoint_every else None, args.checkpoint_every, config, monitor if diagnostics else None):
+        print(f"step={snap['step']} time={snap['time']:.6g} bodies={len(snap['mass'])}")
+        if args.output:
+            snapshots.append(snap)
+    elapsed = time.perf_counter() - first
+    last = snap["step"] - start
+    print(f"Simulated {last} steps in {elapsed:.3f}s ({last / elapsed if elapsed > 0 else float('inf'):.1f} steps/s)")
+    if config.adaptive and bodies.timestepper is not None:
+        report = bodies.timestepper.report()
+        print(f"Block timesteps: {report['evaluations']} force evaluations, {report['saved']} saved against a fixed dt run ({report['speedup']:.1f}x)")
+
+    if sampler:
+        sampler.stop()
+        print(sampler.report())
+        if args.samples_output:
+            sampler.dump(args.samples_output)
+    if profiler.enabled:
+        print(profiler.report())
+        if args.profile_output:
+            profiler.dump(args.profile_output)
+
+    if log is not None:
+        log.close()
+        print(f"Wrote {log.frames} frames to {config.log_path}")
+    if diagnostics is not None:
+        diagnostics.close()
+        print(f"Wrote the diagnostics to {args.diagnostics}")
+    if args.output:
+        save_snapshots(args.output, snapshots)
+
+if __name__ == "__main__":
+    main()
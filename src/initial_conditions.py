@@ -0,0 +1,177 @@
+import os
+import numpy as np
+
+"""
+Initial conditions.
+
+The "bodies" entry of a configuration can be
+
+- an inline list of bodies, each with the Body constructor arguments by name:
+      [{"x": 400, "y": 300, "m": 5.9e9, "v_x": 0, "v_y": 0, "color": [0, 0, 255], "r": 32}, ...]
+- a path to a file of bodies, or {"file": path}. The file can be
+      .npz - one array per column
+      .npy - a structured array with one field per column, or a plain 2D array with the columns in COLUMNS order
+      .csv - a header line naming the columns, then one body per line
+  Columns are named like the Body arguments (x, y, m, v_x, v_y, r, and color or red, green, blue)
+  or like the ParticleSystem arrays (position, velocity, mass, radius, color).
+- a generator, {"generator": "plummer", "n": 100000, "seed": 1, ...} with the generator's parameters
+  (see GENERATORS). Generator masses are given in kg and scaled by mass_stability_scale, like the default bodies.
+
+Every form is turned straight into the arrays of a ParticleSystem without building a Body per row,
+so millions of bodies load in about the time it takes to read or generate the arrays.
+Only the mass (and for files and lists the position) is required; bodies default to being at rest
+with a radius of 1 pixel and a white color.
+"""
+COLUMNS = ("x", "y", "m", "v_x", "v_y", "r", "red", "green", "blue")
+
+"""
+ParticleSystem arrays from named columns
+"""
+def from_columns(columns):
+    if "position" in columns:
+        position = np.asarray(columns["position"], dtype=np.float64).reshape(-1, 2)
+    else:
+        position = np.column_stack([columns["x"], columns["y"]]).astype(np.float64)
+    n = len(position)
+    if "velocity" in columns:
+        velocity = np.asarray(columns["velocity"], dtype=np.float64).reshape(-1, 2)
+    elif "v_x" in columns or "v_y" in columns:
+        velocity = np.column_stack([columns.get("v_x", np.zeros(n)), columns.get("v_y", np.zeros(n))]).astype(np.float64)
+    else:
+        velocity = np.zeros((n, 2))
+    mass = np.asarray(columns["mass"] if "mass" in columns else columns["m"], dtype=np.float64)
+    radius = np.broadcast_to(np.asarray(columns.get("radius", columns.get("r", 1)), dtype=np.float64), (n,)).copy()
+    if "color" in columns:
+        color = np.broadcast_to(np.asarray(columns["color"]), (n, 3))
+    elif "red" in columns:
+        color = np.column_stack([columns["red"], columns["green"], columns["blue"]])
+    else:
+        color = np.full((n, 3), 255)
+    return {"position": position, "velocity": velocity, "mass": mass, "radius": radius, "color": np.asarray(color, dtype=np.uint8)}
+
+"""
+Arrays of an inline list of body dictionaries
+"""
+def from_list(entries):
+    for i, entry in enumerate(entries):
+        missing = {"x", "y", "m"} - set(entry)
+        if missing:
+            raise ValueError(f"Body {i} is missing {sorted(missing)}")
+    keys = set().union(*entries)
+    defaults = {"v_x": 0.0, "v_y": 0.0, "r": 1.0, "color": (255, 255, 255)}
+    return from_columns({key: np.array([entry.get(key, defaults.get(key)) for entry in entries]) for key in keys})
+
+"""
+Arrays of a .npz, .npy or .csv file of bodies
+"""
+def from_file(path):
+    match os.path.splitext(path)[1].lower():
+        case ".npz":
+            with np.load(path) as data:
+                return from_columns({name: data[name] for name in data.files})
+        case ".npy":
+            data = np.load(path, mmap_mode="r")
+            if data.dtype.names:
+                return from_columns({name: data[name] for name in data.dtype.names})
+            data = np.atleast_2d(data)
+            return from_columns({name: data[:, i] for i, name in enumerate(COLUMNS[:data.shape[1]])})
+        case ".csv":
+            with open(path) as f:
+                names = [name.strip() for name in f.readline().split(",")]
+            data = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+            return from_columns({name: data[:, i] for i, name in enumerate(names)})
+        case extension:
+            raise ValueError(f"Unsupported bodies file type {extension}, expected .npz, .npy or .csv")
+
+"""
+Generators. Every generator takes the number of bodies, a seed, the scaled gravitational constant g
+and the mass scale, plus its own parameters, and returns ParticleSystem arrays. Positions are in
+pixels around `center`, velocities are set up for a system close to equilibrium.
+"""
+
+"""
+Plummer sphere laid out in the plane: radii follow the Plummer cumulative mass profile with scale
+length `scale`, speeds are drawn from the Plummer distribution function, all directions are isotropic.
+"""
+def plummer(n, seed=0, g=1.0, mass_scale=1.0, mass=5.972e24, scale=100.0, center=(800, 600), radius=1.0, color=(255, 255, 255)):
+    rng = np.random.default_rng(seed)
+    total = mass * mass_scale
+    #cumulative mass fraction u inside radius r is (r^2 / (r^2 + a^2))^(3/2), cut off at 99.9%
+    u = rng.uniform(0, 0.999, n)
+    r = scale / np.sqrt(u ** (-2 / 3) - 1)
+    #speed as a fraction q of the local escape speed, q^2 (1 - q^2)^(7/2) sampled by rejection
+    q = np.empty(0)
+    while len(q) < n:
+        x = rng.uniform(0, 1, 2 * (n - len(q)) + 16)
+        y = rng.uniform(0, 0.1, len(x))
+        q = np.concatenate([q, x[y < x ** 2 * (1 - x ** 2) ** 3.5]])
+    speed = q[:n] * np.sqrt(2 * g * total / scale) * (1 + (r / scale) ** 2) ** -0.25
+    position = np.asarray(center, dtype=np.float64) + r[:, np.newaxis] * _directions(rng, n)
+    velocity = speed[:, np.newaxis] * _directions(rng, n)
+    velocity -= velocity.mean(axis=0)
+    return from_columns({"position": position, "velocity": velocity, "mass": np.full(n, total / n), "radius": radius, "color": color})
+
+"""
+Keplerian disk: one central body of `central_mass` and n - 1 bodies sharing `disk_mass`, spread
+uniformly in radius between r_min and r_max (a surface density falling off as 1/r), on circular
+orbits around the mass inside them. Orbits are counter-clockwise on screen.
+"""
+def keplerian_disk(n, seed=0, g=1.0, mass_scale=1.0, central_mass=5.972e24, disk_mass=5.972e22, r_min=100.0, r_max=500.0, center=(800, 600), radius=1.0, central_radius=10.0, color=(255, 255, 255), central_color=(0, 0, 255)):
+    rng = np.random.default_rng(seed)
+    r = np.sort(rng.uniform(r_min, r_max, n - 1))
+    phi = rng.uniform(0, 2 * np.pi, n - 1)
+    direction = np.stack([np.cos(phi), np.sin(phi)], axis=1)
+    mass = np.empty(n)
+    mass[0] = central_mass * mass_scale
+    mass[1:] = disk_mass * mass_scale / max(n - 1, 1)
+    #bodies are sorted by radius, so the mass inside each orbit is a running sum
+    enclosed = mass[0] + np.cumsum(mass[1:]) - mass[1:]
+    position = np.empty((n, 2))
+    velocity = np.zeros((n, 2))
+    position[0] = center
+    position[1:] = position[0] + r[:, np.newaxis] * direction
+    velocity[1:] = np.sqrt(g * enclosed / r)[:, np.newaxis] * np.stack([direction[:, 1], -direction[:, 0]], axis=1)
+    radii = np.full(n, radius, dtype=np.float64)
+    radii[0] = central_radius
+    colors = np.empty((n, 3))
+    colors[:] = color
+    colors[0] = central_color
+    return from_columns({"position": position, "velocity": velocity, "mass": mass, "radius": radii, "color": colors})
+
+"""
+Uniform cloud: bodies of equal mass spread uniformly over a disc of radius `extent`, with gaussian
+velocities of standard deviation `dispersion` (0 for a cold collapse).
+"""
+def uniform_cloud(n, seed=0, g=1.0, mass_scale=1.0, mass=5.972e24, extent=500.0, dispersion=0.0, center=(800, 600), radius=1.0, color=(255, 255, 255)):
+    rng = np.random.default_rng(seed)
+    r = extent * np.sqrt(rng.uniform(0, 1, n))
+    position = np.asarray(center, dtype=np.float64) + r[:, np.newaxis] * _directions(rng, n)
+    velocity = rng.normal(0, dispersion, (n, 2)) if dispersion else np.zeros((n, 2))
+    return from_columns({"position": position, "velocity": velocity, "mass": np.full(n, mass * mass_scale / n), "radius": radius, "color": color})
+
+def _directions(rng, n):
+    phi = rng.uniform(0, 2 * np.pi, n)
+    return np.stack([np.cos(phi), np.sin(phi)], axis=1)
+
+GENERATORS = {
+    "plummer": plummer,
+    "keplerian_disk": keplerian_disk,
+    "uniform": uniform_cloud,
+}
+
+"""
+Arrays of the bodies described by a configuration's "bodies" entry, see the top of this file.
+g and mass_scale are passed on to generators.
+"""
+def load(bodies, g=1.0, mass_scale=1.0):
+    if isinstance(bodies, (str, os.PathLike)):
+        return from_file(os.fspath(bodies))
+    if isinstance(bodies, dict):
+        if "file" in bodies:
+            return from_file(bodies["file"])
+        parameters = dict(bodies)
+        name = parameters.pop("generator", None)
+        if name not in GENERATORS:
+            raise ValueError(f"Unknown bodies generator {name}, expected one of {list(GENERATORS)}")
+        return GENERATORS[name](g=g, mass_scale=mass_scale, **parameters)
+    return from_list(list(bodies))
@@ -0,0 +1,134 @@
+"""
+Registry of numerical integration methods.
+
+Every integrator advances a whole ParticleSystem by one step of dt through step(bodies, dt, accelerate),
+where accelerate(position) returns the accelerations for a set of positions. On entry bodies.acceleration
+holds the accelerations at the current positions, and every integrator leaves it holding the accelerations
+at the new positions, so the force evaluation at the end of one step is reused at the start of the next.
+`force_evaluations` is the number of calls to accelerate() a step makes. bodies.prev is left holding the
+positions at the start of the step, which is what VER needs to continue from any other method.
+
+New methods are added by subclassing Integrator and decorating the class with @register.
+"""
+INTEGRATORS = {}
+
+"""
+Update kernels. The leapfrog and Verlet methods move the bodies through these, in place, so a
+compiled backend (see jit.py) can replace them with versions that do not allocate temporaries.
+"""
+def kick(velocity, acceleration, h):
+    velocity += acceleration * h
+
+def drift(position, velocity, h):
+    position += velocity * h
+
+"""
+One position Verlet step: the new positions from the current and previous ones, velocities from the
+central difference, and the current positions become the previous ones
+"""
+def verlet(position, prev, velocity, acceleration, dt):
+    new_position = 2 * position - prev + acceleration * dt ** 2
+    velocity[:] = (new_position - prev) / (2 * dt)
+    prev[:] = position
+    position[:] = new_position
+
+def register(cls):
+    INTEGRATORS[cls.name] = cls
+    return cls
+
+class Integrator:
+    name = None
+    order = None
+    force_evaluations = None
+
+    #`kernels` has kick, drift and verlet functions replacing the NumPy ones above
+    def __init__(self, kernels=None):
+        self.kick = kick if kernels is None else kernels.kick
+        self.drift = drift if kernels is None else kernels.drift
+        self.verlet = verlet if kernels is None else kernels.verlet
+
+    def step(self, bodies, dt, accelerate):
+        raise NotImplementedError
+
+"""
+CA - constant acceleration over the step, first order
+"""
+@register
+class ConstantAcceleration(Integrator):
+    name = "CA"
+    order = 1
+    force_evaluations = 1
+
+    def step(self, bodies, dt, accelerate):
+        bodies.prev = bodies.position.copy()
+        bodies.position += bodies.velocity * dt + bodies.acceleration * dt ** 2 / 2
+        bodies.velocity += bodies.acceleration * dt
+        bodies.acceleration = accelerate(bodies.position)
+
+"""
+VER - position Verlet using the previous position, velocities from the central difference
+"""
+@register
+class Verlet(Integrator):
+    name = "VER"
+    order = 2
+    force_evaluations = 1
+
+    def step(self, bodies, dt, accelerate):
+        self.verlet(bodies.position, bodies.prev, bodies.velocity, bodies.acceleration, dt)
+        bodies.acceleration = accelerate(bodies.position)
+
+"""
+KDK - kick-drift-kick leapfrog, second order and symplectic with synchronized velocities
+"""
+@register
+class Leapfrog(Integrator):
+    name = "KDK"
+    order = 2
+    force_evaluations = 1
+
+    def step(self, bodies, dt, accelerate):
+        bodies.prev = bodies.position.copy()
+        self.kdk(bodies, dt, accelerate)
+
+    def kdk(self, bodies, dt, accelerate):
+        self.kick(bodies.velocity, bodies.acceleration, dt / 2)
+        self.drift(bodies.position, bodies.velocity, dt)
+        bodies.acceleration = accelerate(bodies.position)
+        self.kick(bodies.velocity, bodies.acceleration, dt / 2)
+
+"""
+YOSHIDA4 - fourth order symplectic method, three leapfrog substeps of w1 * dt, w0 * dt and w1 * dt
+"""
+@register
+class Yoshida4(Integrator):
+    name = "YOSHIDA4"
+    order = 4
+    force_evaluations = 3
+    W1 = 1 / (2 - 2 ** (1 / 3))
+    W0 = -2 ** (1 / 3) * W1
+
+    def step(self, bodies, dt, accelerate):
+        bodies.prev = bodies.position.copy()
+        for w in (self.W1, self.W0, self.W1):
+            Leapfrog.kdk(self, bodies, w * dt, accelerate)
+
+"""
+RK4 - classical fourth order Runge Kutta method, not symplectic
+"""
+@register
+class RungeKutta4(Integrator):
+    name = "RK4"
+    order = 4
+    force_evaluations = 4
+
+    def step(self, bodies, dt, accelerate):
+        x0, v0 = bodies.position.copy(), bodies.velocity.copy()
+        k1x, k1v = v0, bodies.acceleration
+        k2x, k2v = v0 + k1v * (dt / 2), accelerate(x0 + k1x * (dt / 2))
+        k3x, k3v = v0 + k2v * (dt / 2), accelerate(x0 + k2x * (dt / 2))
+        k4x, k4v = v0 + k3v * dt, accelerate(x0 + k3x * dt)
+        bodies.prev = x0
+        bodies.position = x0 + (k1x + 2 * k2x + 2 * k3x + k4x) * (dt / 6)
+        bodies.velocity = v0 + (k1v + 2 * k2v + 2 * k3v + k4v) * (dt / 6)
+        bodies.acceleration = accelerate(bodies.position)
@@ -0,0 +1,195 @@
+import numpy as np
+
+"""
+Compiled kernels, used with the "numba" backend.
+
+The direct summation forces, the leapfrog and Verlet updates and the collision pair test are written
+as plain loops and compiled with Numba, so every pair is handled in registers without the tiles of
+temporaries the NumPy versions need. The force loop over target bodies runs in parallel on every
+core, and on a single core the loop still vectorizes, which visiting every pair once does not.
+Compiled code is cached on disk (in __pycache__, or NUMBA_CACHE_DIR), so only the first run after
+a change pays for compiling.
+
+Every function has the signature of the NumPy version it replaces and gives the same results, up to
+the order the forces are summed in. When Numba is not installed, available() is False and the
+NumPy versions are used instead.
+"""
+try:
+    import numba
+except ImportError:
+    numba = None
+
+_warned = False
+
+"""
+True if Numba can be imported. Warns once when it cannot.
+"""
+def available():
+    global _warned
+    if numba is None and not _warned:
+        _warned = True
+        print("ERROR: Numba is not installed, using the NumPy kernels instead.")
+    return numba is not None
+
+def _jit(parallel=False):
+    return numba.njit(cache=True, parallel=parallel, nogil=True)
+
+#offsets of the neighbouring cells every cell is paired with, see bodies.find_collisions()
+CELL_X = np.array([0, 1, 1, 1, 0])
+CELL_Y = np.array([0, -1, 0, 1, 1])
+
+if numba is not None:
+    prange = numba.prange
+
+    #the force sums may be reordered and vectorized, without assuming there are no infinities or NaNs
+    FAST = {"reassoc", "contract", "arcp", "nsz"}
+
+    """
+    Forces on the bodies in `rows` from every body, the rows in parallel. Coordinates come in separate
+    contiguous arrays so the inner loop vectorizes. Constants like `three` are passed in the type of
+    the positions, literals would turn single precision into double. The potential energy is half the
+    sum over the rows, which is the total when every body is a row.
+    """
+    @numba.njit(cache=True, nogil=True, parallel=True, fastmath=FAST)
+    def _forces_rows(x, y, vx, vy, mass, g, eps2, three, rows, ax, ay, jx, jy, want_jerk):
+        n = len(mass)
+        potential = 0.0
+        for k in prange(len(rows)):
+            i = rows[k]
+            sx, sy, tx, ty, own = ax[k], ay[k], jx[k], jy[k], 0.0
+            for j in range(n):
+                dx = x[j] - x[i]
+                dy = y[j] - y[i]
+                r2 = dx * dx + dy * dy + eps2
+                #a body and itself are at distance 0, the conditionals give the self pair no force or potential
+                phi = g / np.sqrt(r2) if j != i else 0 * g
+                w = phi / r2 if j != i else 0 * g
+                sx += w * dx * mass[j]
+                sy += w * dy * mass[j]
+                own += phi * mass[j]
+                if want_jerk:
+                    dvx = vx[j] - vx[i]
+                    dvy = vy[j] - vy[i]
+                    rv = (dx * dvx + dy * dvy) / r2 * three if j != i else 0 * g
+                    tx += w * (dvx - rv * dx) * mass[j]
+                    ty += w * (dvy - rv * dy) * mass[j]
+            ax[k], ay[k], jx[k], jy[k] = sx, sy, tx, ty
+            potential -= 0.5 * own * mass[i]
+        return potential
+
+    @_jit(parallel=True)
+    def _kick(velocity, acceleration, h):
+        for i in prange(len(velocity)):
+            velocity[i, 0] += acceleration[i, 0] * h
+            velocity[i, 1] += acceleration[i, 1] * h
+
+    @_jit(parallel=True)
+    def _verlet(position, prev, velocity, acceleration, dt2, two_dt):
+        for i in prange(len(position)):
+            for k in range(2):
+                new_position = position[i, k] + position[i, k] - prev[i, k] + acceleration[i, k] * dt2
+                velocity[i, k] = (new_position - prev[i, k]) / two_dt
+                prev[i, k] = position[i, k]
+                position[i, k] = new_position
+
+    """
+    Overlapping pairs among bodies sorted into cells, counted on the first pass and stored on the second
+    """
+    @_jit()
+    def _collision_pairs(position, radius, order, cells, start, count, stride):
+        found = 0
+        pairs_i = np.empty(0, dtype=np.int64)
+        pairs_j = np.empty(0, dtype=np.int64)
+        for store in range(2):
+            found = 0
+            for a in range(len(cells)):
+                for o in range(len(CELL_X)):
+                    neighbour = cells[a] + CELL_X[o] * stride + CELL_Y[o]
+                    b = np.searchsorted(cells, neighbour)
+                    if b == len(cells) or cells[b] != neighbour:
+                        continue
+                    for p in range(start[a], start[a] + count[a]):
+                        i = order[p]
+                        first = p + 1 if o == 0 else start[b]
+                        for q in range(first, start[b] + count[b]):
+                            j = order[q]
+                            dx = position[i, 0] - position[j, 0]
+                            dy = position[i, 1] - position[j, 1]
+                            reach = radius[i] + radius[j]
+                            if dx * dx + dy * dy < reach * reach:
+                                if store:
+                                    pairs_i[found] = min(i, j)
+                                    pairs_j[found] = max(i, j)
+                                found += 1
+            if not store:
+                pairs_i = np.empty(found, dtype=np.int64)
+                pairs_j = np.empty(found, dtype=np.int64)
+        return pairs_i, pairs_j
+
+"""
+Direct summation, see bodies.direct_forces(). `budget` is accepted for the same signature, the
+compiled loops need no temporaries. The targets are split across threads and every pair is visited
+from both ends.
+"""
+def direct_forces(position, mass, g, velocity=None, potential=False, targets=None, accumulate=None, softening=0.0, budget=None):
+    accumulate = position.dtype if accumulate is None else np.dtype(accumulate)
+    dtype = position.dtype.type
+    m = mass.astype(position.dtype, copy=False)
+    rows = np.arange(len(mass)) if targets is None else np.asarray(targets, dtype=np.int64)
+    want_jerk = velocity is not None
+    v = position if velocity is None else velocity.astype(position.dtype, copy=False)
+    if potential and targets is not None:
+        raise ValueError("The potential energy can only be summed with every body as a target")
+    x, y = np.ascontiguousarray(position[:, 0]), np.ascontiguousarray(position[:, 1])
+    vx, vy = np.ascontiguousarray(v[:, 0]), np.ascontiguousarray(v[:, 1])
+    ax, ay, jx, jy = np.zeros((4, len(rows)), dtype=accumulate)
+    constants = (dtype(g), dtype(softening * softening), dtype(3))
+    total = _forces_rows(x, y, vx, vy, m, *constants, rows, ax, ay, jx, jy, want_jerk)
+    acc = np.stack((ax, ay), axis=1)
+    jerk = np.stack((jx, jy), axis=1)
+    return acc, jerk if want_jerk else None, float(total) if potential else None
+
+"""
+Update kernels replacing the ones in integrators.py. Scalars are passed in the type of the arrays,
+like NumPy treats Python floats, so both give the same results in single precision.
+"""
+def kick(velocity, acceleration, h):
+    _kick(velocity, acceleration, velocity.dtype.type(h))
+
+def drift(position, velocity, h):
+    _kick(position, velocity, position.dtype.type(h))
+
+def verlet(position, prev, velocity, acceleration, dt):
+    dtype = position.dtype.type
+    _verlet(position, prev, velocity, acceleration, dtype(dt ** 2), dtype(2 * dt))
+
+"""
+Collision pairs, see bodies.find_collisions(). The bodies are sorted into the same cells, then the
+candidate pairs are tested in a compiled loop instead of being built as index arrays.
+"""
+def find_collisions(position, radius):
+    n = len(radius)
+    none = np.empty(0, dtype=np.int64)
+    if n < 2 or radius.max() <= 0:
+        return none, none
+    cell = 2 * radius.max()
+    c = np.floor(position / cell).astype(np.int64)
+    c -= c.min(axis=0)
+    stride = c[:, 1].max() + 3
+    key = c[:, 0] * stride + c[:, 1]
+    order = np.argsort(key, kind="stable")
+    cells, start, count = np.unique(key[order], return_index=True, return_counts=True)
+    return _collision_pairs(position, radius, order, cells, start.astype(np.int64), count.astype(np.int64), np.int64(stride))
+
+"""
+Compile every kernel for the types of `position` now, instead of on the first step
+"""
+def warm_up(dtype=np.float64, accumulate=None):
+    position = np.array([[0.0, 0.0], [3.0, 0.0], [0.5, 0.5]], dtype=dtype)
+    mass = np.ones(3)
+    for velocity in (None, position.copy()):
+        direct_forces(position, mass, 1.0, velocity, True, accumulate=accumulate)
+        direct_forces(position, mass, 1.0, velocity, targets=[0], accumulate=accumulate)
+    kick(position.copy(), position, 0.5)
+    verlet(position.copy(), position.copy(), position.copy(), position, 0.5)
+    find_collisions(position, np.ones(3))
@@ -2,22 +2,45 @@ import os
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
 from bodies import *
 from gui import *
+from trajectory import TrajectoryWriter, next_path
+from checkpoint import save_checkpoint, load_checkpoint
+from tracers import TracerBuffer
+from runner import PhysicsRunner, SpeedMeter
+from profiling import profiler, enable, VERBOSITY
 import argparse
+import io
 
 #Handle any arguments passed to the python script
 parser = argparse.ArgumentParser()
-parser.add_argument(f"-v", "--verbosity", help="Debugger verbosity[LOW/MED/HIGH]")
+parser.add_argument(f"-v", "--verbosity", choices=VERBOSITY, default="LOW", help="Debugger verbosity[LOW/MED/HIGH], MED times every phase of the loop, HIGH also runs the sampling profiler")
+parser.add_argument("--profile-output", help="Save the phase timings to this .csv or .json file on exit")
+parser.add_argument("--samples-output", help="Save the sampled stacks (HIGH verbosity) to this file on exit, in collapsed flame graph format")
+parser.add_argument("-c", "--config", default="simulation_config.json", help="Path to the simulation config")
 parser.add_argument("-w", "--width", help="Screen width")
 parser.add_argument("--height", help="Screen height")
+parser.add_argument("-m", "--method", choices=VALID_METHODS, help="Numerical method, overrides the config")
+parser.add_argument("-p", "--precision", choices=VALID_PRECISIONS, help="Precision of the positions, velocities and forces, overrides the config")
+parser.add_argument("-r", "--restore", help="Start from a checkpoint file instead of the configured bodies")
+parser.add_argument("-s", "--substeps", type=int, help="Physics steps per rendered frame, overrides the config")
+parser.add_argument("--threaded", action="store_true", help="Run the physics on a background thread, decoupled from rendering")
 args=parser.parse_args()
 
-#Nice real-life bodies to simulate(default)
-E_TO_M = 384400 #in km
-EARTH = Body(400, 300, 5.972 * (10**24) * mass_stability_scale, 0, 0, BLUE, round(6357/km_per_pixel))
-MOON = Body(400, 300 + round(E_TO_M / km_per_pixel) / distance_stability_scale, 7.348 * (10**22) * mass_stability_scale, 1.022 / distance_stability_scale, 0, WHITE, round(1738/km_per_pixel))
-MOON2 = Body(400, 300 - round(E_TO_M / km_per_pixel) / distance_stability_scale, 7.348 * (10**23) * mass_stability_scale, 1.522 / distance_stability_scale, 0, BROWN, round(4738/km_per_pixel))
+overrides = {}
+if args.method:
+    overrides["method"] = args.method
+if args.substeps:
+    overrides["substeps"] = args.substeps
+if args.precision:
+    overrides["precision"] = args.precision
+if args.threaded:
+    overrides["threaded"] = True
+config = SimulationConfig.load(args.config, **overrides)
+substeps, threaded, fps = config.substeps, config.threaded, config.fps
+G, dt = config.G, config.dt
+G_SCALED = config.g_scaled
 
 #GUI Screen Settigns
+pygame.init()
 width, height = 1600, 1200
 screen = pygame.display.set_mode((width, height), vsync=True)
 pygame.display.set_caption('N-Body Simulation')
@@ -30,151 +53,172 @@ origin is the top left corner
 """
 
 #set up bodies for simulation
-bodies = config["bodies"] if "bodies" in config and config["bodies"] else [EARTH, MOON, MOON2]
-
-#Store default values for when the simulation is reset
-default_pos = [body.position.copy() for body in bodies]
-default_vel = [body.velocity.copy() for body in bodies]
-default_prev = [body.position.copy() - body.velocity * dt for body in bodies]
-default_bodies = bodies[:]
-
-#Set up previous vector for Verlet integration
-for body in bodies:
-    body.prev = body.position - body.velocity * dt
-    
-
-# Function to draw a slider
-def draw_slider(label, value, x, y, min_val, max_val, step):
-    pygame.draw.rect(screen, SLIDER_BG_COLOR, (x, y, 150, 10))  # Slider background
-    pygame.draw.rect(screen, SLIDER_COLOR, (x + (value - min_val) / (max_val - min_val) * 150 - 5, y - 5, 10, 20))  # Slider handle
-    
-    # Draw label
-    label_text = font.render(f"{label}: {value:.2e}", True, BLACK)
-    screen.blit(label_text, (x + 160, y - 10))
-
-# Function to draw a button
-def draw_button(label, x, y, width, height):
-    pygame.draw.rect(screen, BUTTON_COLOR, (x, y, width, height))  # Button background
-    button_text = font.render(label, True, WHITE)
-    screen.blit(button_text, (x + (width - button_text.get_width()) // 2, y + (height - button_text.get_height()) // 2))
-
-#Simulation variables to control pausing and exiting
+#step counter and simulated time, for trajectory logging and checkpoints
+if args.restore:
+    bodies, state = load_checkpoint(args.restore)
+    G, dt, step_count, sim_time = state["G"], state["dt"], state["step"], state["time"]
+    G_SCALED = config.scaled_g(G)
+    config = config.replace(method=state["method"])
+    bodies.convert(config.dtype)
+else:
+    bodies = load_bodies(config)
+    step_count = 0
+    sim_time = 0.0
+
+#Store the starting state for when the simulation is reset, and the checkpoints saved during the session
+initial_checkpoint = io.BytesIO()
+save_checkpoint(initial_checkpoint, bodies, G, G_SCALED, dt, config.method, step_count, sim_time)
+checkpoints = []
+
+#tracer trails
+tracers = TracerBuffer(bodies.ids, config.tracer_length, config.tracer_decimation)
+trails = TrailLayer((width, height), config.tracer_length * config.tracer_decimation)
+
+#Simulation variable to control exiting, pausing is handled by the physics runner
 running = True
-is_running = False
 
 #clock for animation
 clock = pygame.time.Clock()
 
-#simulation gui objects
-g_slider = Slider("G", G, 40, 60, 0, 1e-9, 1e-11, screen)
-dt_slider = Slider("dt", dt, 40, 120, 1, 10, 0.010, screen)
-start_stop_button = Button("Start/Stop", 50, 180, 100, 40, screen)
-reset_button = Button("Reset", 50, 240, 100, 40, screen)
+#a restored run continues its log from the restored step
+log = TrajectoryWriter(config.log_path, len(bodies), config.log_stride, metadata={"dt": dt, "method": config.method},
+                       resume=step_count if args.restore else None) if config.logging else None
+if log:
+    log.append(bodies, step_count, sim_time)
+
+#physics runs `substeps` steps per frame, or freely on its own thread, and the renderer draws the latest state
+runner = PhysicsRunner(bodies, G_SCALED, dt, step_count, sim_time, log, config)
+if threaded:
+    runner.start()
+speed = SpeedMeter()
 
-#TODO: draw a frame when resetting or when first loading
+#phase timers, and the sampling profiler of the thread the physics runs on
+sampler = enable(args.verbosity, runner.thread.ident if threaded else None)
+
+#simulation gui objects, shared with viewer.py
+panel = ControlPanel(screen, G, dt, profiler)
+
+#draw a single frame, used on start and when resetting or restoring while paused
 def draw_frame():
-    draw_sidebar(screen, height)
-    g_slider.draw()
-    dt_slider.draw()
-    start_stop_button.draw()
-    reset_button.draw()
-    for i, body in enumerate(bodies):
-        x, y = body.position.flatten()
-        x, y = int(x), int(y)
-        #Draw body
-        pygame.draw.circle(screen, body.color, (x, y), body.radius)
+    system, step_count, sim_time = runner.sample()
+    panel.draw(system, speed, sim_time)
     pygame.display.flip()
 
 #pause function
 def pause():
-    global is_running
-    is_running = not is_running
+    if runner.paused:
+        runner.resume()
+    else:
+        runner.pause()
+    speed.reset()
     print(f"DEBUG: Paused, G={G}, dt={dt}")
 
+#restore the simulation from a checkpoint path or file object.
+#The steps from there on are logged to a new file, so every log only moves forward in time.
+def restore(checkpoint):
+    global G, G_SCALED, dt, config, log
+    bodies, state = load_checkpoint(checkpoint)
+    G, dt = state["G"], state["dt"]
+    G_SCALED = config.scaled_g(G)
+    config = config.replace(method=state["method"])
+    bodies.convert(config.dtype)
+    previous = log
+    if log:
+        log = TrajectoryWriter(next_path(config.log_path), len(bodies), config.log_stride, metadata={"dt": dt, "method": config.method})
+        log.append(bodies, state["step"], state["time"])
+    runner.replace(bodies, G_SCALED, dt, state["step"], state["time"], config, log)
+    if previous:
+        previous.close()
+        print(f"DEBUG: Logging to {log.path} from step {state['step']}")
+    panel.set_values(G, dt)
+    tracers.reset(bodies.ids)
+    trails.clear()
+    speed.reset()
+    print(f"DEBUG: Restored step {state['step']}, G={G}, dt={dt}")
+    if runner.paused:
+        screen.fill(BLACK)
+        draw_frame()
+
 #reset function
 def reset():
-    bodies = default_bodies[:]
-    #set all attributes back to stored defaults
-    for i in range(len(bodies)):
-        bodies[i].position = default_pos[i].copy()
-        bodies[i].velocity = default_vel[i].copy()
-        bodies[i].prev = default_prev[i].copy()
-        bodies[i].acceleration = np.zeros_like(bodies[i].acceleration)
-        bodies[i].tracer = []
-        print(f"DEBUG: Reset, G={G}, dt={dt}")
-    #TODO: figure out why this does not work as inteneded
-    if not is_running:
-        draw_frame()
+    restore(initial_checkpoint)
+
+#save a checkpoint of the current state
+def save():
+    os.makedirs(config.checkpoint_dir, exist_ok=True)
+    with runner.lock:
+        path = os.path.join(config.checkpoint_dir, f"checkpoint_{runner.step_count}.npz")
+        save_checkpoint(path, runner.bodies, G, runner.g, runner.dt, config.method, runner.step_count, runner.sim_time)
+    checkpoints.append(path)
+    print(f"DEBUG: Saved checkpoint {len(checkpoints)} to {path}")
 
 #Begin the simulation
-print(f"DEBUG: Simulation started, G={G}, dt={dt}, km-per-pixel={km_per_pixel}, distance-scaling={distance_stability_scale}, mass-scaling={mass_stability_scale}")
+print(f"DEBUG: Simulation started, G={G}, dt={dt}, km-per-pixel={config.km_per_pixel}, distance-scaling={config.distance_stability_scale}, mass-scaling={config.mass_stability_scale}, method={config.method}, solver={config.solver}, precision={config.precision}, substeps={substeps}, threaded={threaded}")
+if config.solver == "BH":
+    print(f"DEBUG: Barnes-Hut theta={config.theta}, relative force error vs direct summation: {force_error(bodies, G_SCALED, config.theta, softening=config.softening)}")
+if config.precision != "float64":
+    print(f"DEBUG: Relative energy drift against float64: {precision_error(bodies, G_SCALED, dt, config)}")
 draw_frame()
 while running:
     #Get user inputs
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             running = False
-        
-        g_slider.update(event)
-        dt_slider.update(event)
-        start_stop_button.check_click(event, pause)
-        reset_button.check_click(event, reset)
+        #C saves a checkpoint, 1-9 jump back to the checkpoint saved in that order, P shows or hides the profiler overlay
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_c:
+                save()
+            elif event.key == pygame.K_p:
+                panel.overlay.visible = not panel.overlay.visible
+            elif pygame.K_1 <= event.key <= pygame.K_9 and event.key - pygame.K_1 < len(checkpoints):
+                restore(checkpoints[event.key - pygame.K_1])
+
+        panel.update(event, pause, reset)
     
-    #Check for paused state
-    if not is_running:
+    #Check for paused state, waiting for the next frame instead of spinning
+    if runner.paused:
+        clock.tick(fps)
         continue
     
-    #GUI inputs
-    G = g_slider.value
-    dt = dt_slider.value
-
-    #simulate
-    calculate(bodies, G_SCALED)
-    update(bodies, dt)
-
-    screen.fill(BLACK)
-
-    #Draw GUI elemnets
-    draw_sidebar(screen, height)
-    g_slider.draw()
-    dt_slider.draw()
-    start_stop_button.draw()
-    reset_button.draw()
-
-    #nice graphics
-    for i, body in enumerate(bodies):
-
-        #collision detection
-        for j in range(i+1, len(bodies)):
-            handle_colision(bodies[i], bodies[j], bodies, G_SCALED, dt)
-
-        #nice tracer graphics
-        body.tracer.append((int(body.position[0]), int(body.position[1])))
-        if len(body.tracer) > 1500:
-            body.tracer.pop(0)
-
-        x, y = body.position.flatten()
-        x, y = int(x), int(y)
-        #Draw body
-        pygame.draw.circle(screen, body.color, (x, y), body.radius)
-        #draw tracers
-        if TRACER and len(body.tracer) > 1:
-            pygame.draw.lines(screen, body.color, False, body.tracer, 2)
-        #draw vectors
-        origin = (int(body.position[0]), int(body.position[1]))
-        draw_vector(screen, origin, body.velocity.flatten(), RED, 1000)
-        draw_vector(screen, origin, body.acceleration.flatten(), GREEN, 1e6)
-
-        #draw key
-        draw_vector(screen, (width - 160, 10), np.array([[30.0], [0.0]]).flatten(), RED)
-        vel_label = font.render("Velocity", True, RED)
-        screen.blit(vel_label, (width - 100, 5))
-        draw_vector(screen, (width - 160, 30), np.array([[30.0], [0.0]]).flatten(), GREEN)
-        vel_label = font.render("Acceleration", True, GREEN)
-        screen.blit(vel_label, (width - 110, 25))
+    #GUI inputs, picked up by the physics runner on its next step
+    G = panel.g_slider.value
+    G_SCALED = config.scaled_g(G)
+    dt = panel.dt_slider.value
+    runner.g, runner.dt = G_SCALED, dt
+
+    #simulate, unless the physics thread is already doing so
+    if not threaded:
+        with profiler.phase("physics"):
+            runner.advance(substeps)
+    system, step_count, sim_time = runner.sample()
+    speed.update(step_count, sim_time)
+
+    #tracer trails
+    with profiler.phase("tracers"):
+        if config.tracer:
+            trails.update(screen, tracers, system)
+        else:
+            screen.fill(BLACK)
+
+    with profiler.phase("draw"):
+        #Draw GUI elemnets and the bodies
+        panel.draw(system, speed, sim_time)
 
     #refresh
-    pygame.display.flip()
-    clock.tick(60)
-
+    with profiler.phase("flip"):
+        pygame.display.flip()
+    clock.tick(fps)
+
+runner.stop()
+if sampler:
+    sampler.stop()
+    print(f"DEBUG: Sampling profile\n{sampler.report()}")
+    if args.samples_output:
+        sampler.dump(args.samples_output)
+if profiler.enabled:
+    print(f"DEBUG: Phase timings\n{profiler.report()}")
+    if args.profile_output:
+        profiler.dump(args.profile_output)
+if log:
+    log.close()
 pygame.quit()
@@ -0,0 +1,112 @@
+import atexit
+import os
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+import bodies
+
+"""
+Multi-core direct summation.
+
+Positions, masses and accelerations live in shared memory buffers that every worker process
+maps once, when the pool starts. Each step the parent copies the current positions and masses
+into the buffers and hands out ranges of rows of the serial solver's tiles, sending nothing but
+the range bounds. Like the serial solver, every pair is visited once and its force applied to
+both bodies, so the pool does no more pair work than DIRECT. A range of rows reaches every body
+after it, so each task writes the partial accelerations of every body into its own slot of the
+shared output, and the parent adds the slots up.
+"""
+BLOCKS_PER_WORKER = 4 #more tasks than workers evens out the load
+
+#buffers mapped by a worker process
+_shared = {}
+
+def _attach(names):
+    for key, (name, shape) in names.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _shared[key] = (shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf))
+
+"""
+Worker task: the accelerations from the pairs of bodies [lo, hi) with themselves and the bodies after
+them, among the first n, written to output slot `slot`. The temporaries are kept within `budget` bytes.
+"""
+def _work(lo, hi, slot, n, g, softening, budget):
+    position = _shared["position"][1][:n]
+    mass = _shared["mass"][1][:n]
+    acc = _shared["acceleration"][1][slot]
+    acc[:n] = bodies.direct_forces(position, mass, g, softening=softening, budget=budget, rows=(lo, hi))[0]
+
+"""
+Edges of `parts` ranges of rows of n bodies that each hold about the same number of pairs. The rows
+near the start pair with more bodies after them, so the ranges get wider towards the end.
+"""
+def row_edges(n, parts):
+    share = np.arange(parts + 1) / parts
+    edges = np.round(n * (1 - np.sqrt(1 - share))).astype(int)
+    return np.unique(edges)
+
+class ParallelSolver:
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.slots = self.workers * BLOCKS_PER_WORKER
+        self.capacity = 0
+        self.pool = None
+        self.buffers = {}
+
+    """
+    Make sure the shared buffers can hold n bodies. Growing them restarts the pool so the
+    workers map the new buffers, the buffers are grown with headroom so this is rare.
+    """
+    def _reserve(self, n):
+        if n <= self.capacity and self.pool is not None:
+            return
+        self.close()
+        self.capacity = max(n, int(self.capacity * 1.5))
+        shapes = {"position": (self.capacity, 2), "mass": (self.capacity,), "acceleration": (self.slots, self.capacity, 2)}
+        names = {}
+        for key, shape in shapes.items():
+            shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 8)
+            self.buffers[key] = (shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf))
+            names[key] = (shm.name, shape)
+        self.pool = mp.Pool(self.workers, initializer=_attach, initargs=(names,))
+
+    def accelerations(self, position, mass, g, softening=0.0, budget=None):
+        n = len(mass)
+        self._reserve(n)
+        self.buffers["position"][1][:n] = position
+        self.buffers["mass"][1][:n] = mass
+        edges = row_edges(n, min(n, self.slots))
+        tasks = [(int(lo), int(hi), slot, n, g, softening, budget) for slot, (lo, hi) in enumerate(zip(edges[:-1], edges[1:]))]
+        self.pool.starmap(_work, tasks)
+        return self.buffers["acceleration"][1][:len(tasks), :n].sum(axis=0)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        for shm, _ in self.buffers.values():
+            shm.close()
+            shm.unlink()
+        self.buffers = {}
+
+#solver shared by calls to accelerations(), restarted if the worker count changes
+_solver = None
+
+"""
+Calculate the acceleration on every body by direct summation spread over `workers` processes,
+see direct_accelerations() in bodies.py for `softening` and `budget`
+"""
+def accelerations(position, mass, g, workers=None, softening=0.0, budget=None):
+    global _solver
+    workers = workers or os.cpu_count() or 1
+    if _solver is None or _solver.workers != workers:
+        if _solver is not None:
+            _solver.close()
+        _solver = ParallelSolver(workers)
+    return _solver.accelerations(position, mass, g, softening, budget)
+
+@atexit.register
+def _shutdown():
+    if _solver is not None:
+        _solver.close()
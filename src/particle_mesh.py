@@ -0,0 +1,79 @@
+import numpy as np
+
+"""
+Particle-mesh gravity solver.
+
+Masses are deposited onto a square grid with cloud-in-cell (CIC) weighting, the potential
+is found with FFTs and the accelerations are interpolated back to the bodies with the same
+CIC weights, so the cost per step is O(N + M log M) for an M-cell mesh.
+
+The bodies live in a plane but still attract with a 1/r^2 force, so the potential is the
+convolution of the mass grid with the free-space Green's function -G/r rather than the
+solution of a periodic 2D Poisson equation (which would give a 1/r force). The grid is
+zero padded to twice its size so the FFT convolution does not wrap around.
+
+The mesh is centered on the center of mass. Bodies outside of it are clamped onto its edge
+cells, so the mesh should be sized to cover the whole distribution.
+"""
+
+"""
+FFT of the Green's function for a grid x grid mesh with unit G, padded to 2 * grid.
+The r = 0 cell uses the mean of 1/r over a cell instead of a singularity.
+"""
+_kernels = {}
+def _green_fft(grid, cell):
+    key = (grid, cell)
+    if key not in _kernels:
+        i = np.arange(2 * grid)
+        i = np.minimum(i, 2 * grid - i) * cell
+        r = np.sqrt(i[:, np.newaxis] ** 2 + i[np.newaxis, :] ** 2)
+        r[0, 0] = cell / (4 * np.log(1 + np.sqrt(2)))
+        _kernels[key] = np.fft.rfft2(-1 / r)
+    return _kernels[key]
+
+"""
+Lower-left cell index and CIC weights of every body on a grid x grid mesh
+"""
+def _cic(position, origin, grid, cell):
+    u = (position - origin) / cell - 0.5
+    u = np.clip(u, 0, grid - 1 - 1e-9)
+    i0 = np.minimum(np.floor(u).astype(np.int64), grid - 2)
+    f = u - i0
+    index = i0[:, 0] * grid + i0[:, 1]
+    corners = (index, index + grid, index + 1, index + grid + 1)
+    weights = ((1 - f[:, 0]) * (1 - f[:, 1]), f[:, 0] * (1 - f[:, 1]), (1 - f[:, 0]) * f[:, 1], f[:, 0] * f[:, 1])
+    return corners, weights
+
+"""
+Deposit the masses onto the mesh, returning the mass per cell as a grid x grid array indexed [x, y]
+"""
+def deposit(position, mass, origin, grid, cell):
+    corners, weights = _cic(position, origin, grid, cell)
+    rho = np.bincount(np.concatenate(corners), weights=np.concatenate([mass * w for w in weights]), minlength=grid * grid)
+    return rho.reshape(grid, grid)
+
+"""
+Potential on the mesh produced by a grid of masses
+"""
+def potential(rho, g, cell):
+    grid = rho.shape[0]
+    phi = np.fft.irfft2(np.fft.rfft2(rho, s=(2 * grid, 2 * grid)) * _green_fft(grid, cell), s=(2 * grid, 2 * grid))
+    return g * phi[:grid, :grid]
+
+"""
+Calculate the acceleration on every body on a grid x grid mesh of cells `cell` world units wide
+"""
+def accelerations(position, mass, g, grid=256, cell=8.0):
+    total = mass.sum()
+    center = (position * mass[:, np.newaxis]).sum(axis=0) / total if total > 0 else position.mean(axis=0)
+    origin = center - grid * cell / 2
+
+    phi = potential(deposit(position, mass, origin, grid, cell), g, cell)
+    gx, gy = np.gradient(phi, cell)
+
+    corners, weights = _cic(position, origin, grid, cell)
+    acc = np.zeros_like(position)
+    for index, w in zip(corners, weights):
+        acc[:, 0] -= w * gx.ravel()[index]
+        acc[:, 1] -= w * gy.ravel()[index]
+    return acc
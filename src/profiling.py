@@ -0,0 +1,206 @@
+import collections
+import csv
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+"""
+Per-phase profiling.
+
+Code marks the phases of the step and frame loops with
+
+    with profiler.phase("forces"):
+        ...
+
+When the profiler is disabled, phase() hands back a shared do-nothing context manager, so the
+instrumentation costs one attribute check per phase. When enabled, every phase keeps its last
+`window` durations for rolling averages and percentiles, and a running total over the whole run.
+Phases nest, and the time of a phase includes the phases inside it: "integrate" includes "forces".
+
+SamplingProfiler is a statistical profiler for finding what is slow inside a phase: a background
+thread periodically records the Python call stack of one thread.
+"""
+PERCENTILES = (50, 95, 99)
+
+class PhaseTimer:
+    def __init__(self, window):
+        self.samples = np.zeros(window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.samples[self.count % len(self.samples)] = seconds
+        self.count += 1
+        self.total += seconds
+
+    """
+    Mean, percentiles and maximum over the rolling window, in seconds, and the totals over the run
+    """
+    def stats(self):
+        recent = self.samples[:min(self.count, len(self.samples))]
+        if len(recent) == 0:
+            return {"count": 0, "total": 0.0, "mean": 0.0, **{f"p{p}": 0.0 for p in PERCENTILES}, "max": 0.0}
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": float(recent.mean()),
+            **{f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(recent, PERCENTILES))},
+            "max": float(recent.max()),
+        }
+
+class Phase:
+    __slots__ = ("timer", "start")
+
+    def __init__(self, timer):
+        self.timer = timer
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(time.perf_counter() - self.start)
+
+class NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+NO_PHASE = NoPhase()
+
+class Profiler:
+    def __init__(self, enabled=False, window=600):
+        self.enabled = enabled
+        self.window = window
+        self.timers = {}
+
+    def phase(self, name):
+        if not self.enabled:
+            return NO_PHASE
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = PhaseTimer(self.window)
+        return Phase(timer)
+
+    def reset(self):
+        self.timers = {}
+
+    """
+    Statistics of every phase, in the order the phases were first seen
+    """
+    def stats(self):
+        return {name: timer.stats() for name, timer in list(self.timers.items())}
+
+    """
+    Write the statistics to a .csv file, one row per phase, or to any other path as JSON
+    """
+    def dump(self, path):
+        stats = self.stats()
+        if os.path.splitext(path)[1].lower() == ".csv":
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                columns = ["count", "total", "mean", *(f"p{p}" for p in PERCENTILES), "max"]
+                writer.writerow(["phase", *columns])
+                for name, row in stats.items():
+                    writer.writerow([name, *(row[column] for column in columns)])
+        else:
+            with open(path, "w") as f:
+                json.dump(stats, f, indent=2)
+
+    """
+    Table of the statistics, in milliseconds
+    """
+    def report(self):
+        lines = [f"{'phase':<12}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)"]
+        for name, row in self.stats().items():
+            lines.append(f"{name:<12}{row['count']:>8}" + "".join(f"{row[key] * 1e3:>10.3f}" for key in ("mean", "p50", "p95", "p99", "max")))
+        return "\n".join(lines)
+
+#shared profiler the simulation phases report to, disabled until enabled from the command line
+profiler = Profiler()
+
+"""
+Levels of the --verbosity command line option:
+LOW - no profiling
+MED - phase timers
+HIGH - phase timers and the sampling profiler
+"""
+VERBOSITY = ["LOW", "MED", "HIGH"]
+
+"""
+Turn profiling on for a verbosity level. Returns the running SamplingProfiler of thread `thread_id`
+(the calling thread by default) at HIGH, otherwise None.
+"""
+def enable(verbosity, thread_id=None):
+    profiler.enabled = verbosity in ("MED", "HIGH")
+    if verbosity != "HIGH":
+        return None
+    sampler = SamplingProfiler(thread_id)
+    sampler.start()
+    return sampler
+
+"""
+Statistical profiler. While running, a background thread records the call stack of the thread it
+was created on (or `thread_id`) every `interval` seconds. The stacks can be summarised per function
+or written in the collapsed format flame graph tools read.
+"""
+class SamplingProfiler:
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _sample(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    """
+    The `top` functions by share of samples spent inside them, directly or in what they call
+    """
+    def report(self, top=20):
+        inclusive = collections.Counter()
+        for stack, count in self.stacks.items():
+            for function in set(stack):
+                inclusive[function] += count
+        lines = [f"{self.samples} samples every {self.interval * 1e3:g} ms"]
+        for function, count in inclusive.most_common(top):
+            lines.append(f"{100 * count / max(self.samples, 1):6.1f}%  {function}")
+        return "\n".join(lines)
+
+    """
+    Write the stacks in collapsed format, one "outer;...;inner count" line per stack
+    """
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
@@ -0,0 +1,196 @@
+import json
+import struct
+import numpy as np
+
+"""
+Wire protocol between the simulation server and its viewers.
+
+Every message is a HEADER (payload length, message kind) followed by the payload. Control and
+status messages are JSON objects with a "type" key:
+
+    viewer -> server  {"type": "subscribe", "fps": 30}     frame rate the viewer wants
+                      {"type": "set", "G": 6.67e-11, "dt": 2}  like the G and dt sliders, either key optional
+                      {"type": "start"} / {"type": "stop"} / {"type": "toggle"}  like Start/Stop
+                      {"type": "reset"}                    like Reset
+    server -> viewer  {"type": "hello", ...}               the settings of the run, sent on connecting
+                      {"type": "status", "G", "dt", "paused"}  sent to every viewer when they change
+
+State is streamed as binary frames. Positions are quantized to multiples of `quantum` pixels and
+sent as the difference from the last frame that viewer received, in the fewest bytes per value
+(1, 2 or 4) that hold every difference. A frame also lists the bodies that merged since the last
+one, with the body each merged into, and the new radius of every body whose radius changed.
+The first frame, and the first after a reset or any other change of bodies, is a keyframe holding
+the full state. Velocities and accelerations are only sent for systems small enough to draw vectors.
+"""
+HEADER = struct.Struct("<IB")
+JSON, FRAME = 1, 2
+
+#flags, step, time, bodies, merged bodies, radius updates, bytes per position difference
+FRAME_HEADER = struct.Struct("<BqdIIIB")
+KEYFRAME, VECTORS = 1, 2
+
+QUANTUM = 1 / 64 #pixels per position unit
+VECTOR_LIMIT = 100 #largest system velocities and accelerations are sent for
+WIDTHS = {1: np.int8, 2: np.int16, 4: np.int32}
+
+def pack(kind, payload):
+    return HEADER.pack(len(payload), kind) + payload
+
+def pack_json(message):
+    return pack(JSON, json.dumps(message).encode())
+
+"""
+Read one message from an asyncio StreamReader. Returns (kind, payload), JSON payloads decoded.
+"""
+async def read_message(reader):
+    length, kind = HEADER.unpack(await reader.readexactly(HEADER.size))
+    payload = await reader.readexactly(length)
+    return kind, json.loads(payload) if kind == JSON else payload
+
+"""
+Read one message from a blocking socket, see read_message()
+"""
+def recv_message(sock):
+    length, kind = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    payload = _recv_exactly(sock, length)
+    return kind, json.loads(payload) if kind == JSON else payload
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by the server")
+        data += chunk
+    return bytes(data)
+
+def quantize(position, quantum=QUANTUM):
+    limit = np.iinfo(np.int32).max
+    return np.clip(np.round(np.nan_to_num(position / quantum)), -limit, limit).astype(np.int32)
+
+"""
+Encodes the frames of one viewer. It remembers what that viewer was last sent, so a dropped frame
+only means the next difference spans a longer time.
+"""
+class FrameEncoder:
+    def __init__(self, quantum=QUANTUM):
+        self.quantum = quantum
+        self.ids = None
+        self.position = None
+        self.radius = None
+        self.merges = 0 #merge batches of the system already sent
+        self.generation = None
+
+    """
+    Frame of a published system. `generation` changes whenever the server swaps in a different
+    system (a reset), which always starts a keyframe.
+    """
+    def encode(self, system, step, time, generation=0):
+        position = quantize(system.position, self.quantum)
+        radius = system.radius.astype(np.float32)
+        ids = system.ids.astype(np.int64)
+        vectors = len(ids) <= VECTOR_LIMIT
+        flags = VECTORS if vectors else 0
+
+        rows = None
+        if self.ids is not None and len(self.ids) and generation == self.generation:
+            #rows of the last frame each body was in, a keyframe if any body is new or out of order
+            order = np.argsort(self.ids)
+            rows = order[np.minimum(np.searchsorted(self.ids, ids, sorter=order), len(self.ids) - 1)]
+            if not np.array_equal(self.ids[rows], ids) or np.any(np.diff(rows) <= 0):
+                rows = None
+
+        parts = []
+        if rows is None:
+            flags |= KEYFRAME
+            merged = updated = np.empty(0, dtype=np.int64)
+            width = 4
+            parts += [ids.tobytes(), position.tobytes(), radius.tobytes(), system.color.astype(np.uint8).tobytes()]
+        else:
+            events = system.merges[self.merges:]
+            removed = np.concatenate([e[0] for e in events]).astype(np.int64) if events else np.empty(0, dtype=np.int64)
+            into = np.concatenate([e[1] for e in events]).astype(np.int64) if events else np.empty(0, dtype=np.int64)
+            #bodies that left without a recorded merge are reported as merged into themselves
+            gone = np.setdiff1d(np.delete(self.ids, rows), removed)
+            removed, into = np.concatenate([removed, gone]), np.concatenate([into, gone])
+            keep = np.isin(removed, self.ids)
+            merged = removed[keep]
+            updated = np.flatnonzero(radius != self.radius[rows])
+            delta = position.astype(np.int64) - self.position[rows]
+            span = int(np.abs(delta).max()) if len(delta) else 0
+            width = 1 if span <= 127 else 2 if span <= 32767 else 4
+            parts += [merged.tobytes(), into[keep].tobytes(), ids[updated].tobytes(), radius[updated].tobytes(), delta.astype(WIDTHS[width]).tobytes()]
+        if vectors:
+            parts += [system.velocity.astype(np.float32).tobytes(), system.acceleration.astype(np.float32).tobytes()]
+
+        self.ids, self.position, self.radius = ids, position.astype(np.int64), radius
+        self.merges = len(system.merges)
+        self.generation = generation
+        return FRAME_HEADER.pack(flags, step, time, len(ids), len(merged), len(updated), width) + b"".join(parts)
+
+"""
+Rebuilds the state of the system from a stream of frames
+"""
+class FrameDecoder:
+    def __init__(self, quantum=QUANTUM):
+        self.quantum = quantum
+        self.ids = np.empty(0, dtype=np.int64)
+        self.position = np.empty((0, 2), dtype=np.int64)
+        self.radius = np.empty(0, dtype=np.float32)
+        self.color = np.empty((0, 3), dtype=np.uint8)
+        self.velocity = None
+        self.acceleration = None
+        self.step = 0
+        self.time = 0.0
+        self.frames = 0
+        self.keyframes = 0
+
+    """
+    Apply one frame. Returns the (merged ids, ids they merged into) it reported.
+    """
+    def apply(self, payload):
+        flags, self.step, self.time, n, m, u, width = FRAME_HEADER.unpack_from(payload)
+        offset = FRAME_HEADER.size
+        def take(dtype, count, shape=()):
+            nonlocal offset
+            array = np.frombuffer(payload, dtype=dtype, count=count * int(np.prod(shape, dtype=np.int64)), offset=offset)
+            offset += array.nbytes
+            return array.reshape((count, *shape))
+
+        if flags & KEYFRAME:
+            self.ids = take(np.int64, n).copy()
+            self.position = take(np.int32, n, (2,)).astype(np.int64)
+            self.radius = take(np.float32, n).copy()
+            self.color = take(np.uint8, n, (3,)).copy()
+            merged = into = np.empty(0, dtype=np.int64)
+            self.keyframes += 1
+        else:
+            merged, into = take(np.int64, m), take(np.int64, m)
+            updated, radius = take(np.int64, u), take(np.float32, u)
+            keep = ~np.isin(self.ids, merged)
+            self.ids, self.position, self.radius, self.color = self.ids[keep], self.position[keep], self.radius[keep], self.color[keep]
+            order = np.argsort(self.ids)
+            self.radius[order[np.searchsorted(self.ids, updated, sorter=order)]] = radius
+            self.position += take(WIDTHS[width], n, (2,))
+        if flags & VECTORS:
+            self.velocity = take(np.float32, n, (2,)).astype(np.float64)
+            self.acceleration = take(np.float32, n, (2,)).astype(np.float64)
+        else:
+            self.velocity = self.acceleration = None
+        self.frames += 1
+        return merged, into
+
+    """
+    Arrays of the current state, in the layout of ParticleSystem.from_arrays()
+    """
+    def arrays(self):
+        zeros = np.zeros((len(self.ids), 2))
+        return {
+            "position": self.position * self.quantum,
+            "velocity": zeros if self.velocity is None else self.velocity,
+            "acceleration": zeros if self.acceleration is None else self.acceleration,
+            "mass": np.zeros(len(self.ids)),
+            "radius": self.radius.astype(np.float64),
+            "color": self.color,
+            "ids": self.ids,
+        }
@@ -0,0 +1,156 @@
+import threading
+import time
+import numpy as np
+import bodies as sim
+from profiling import profiler
+
+"""
+Physics runner, decouples the integrator from the render loop.
+
+In synchronous mode the render loop calls advance() with the number of substeps to take per frame,
+and draws the live system. In threaded mode start() runs the physics as fast as it can on a
+background thread, and the renderer samples the latest published copy of the system at its own
+frame rate, so a slow frame never stalls the integrator and a slow step never stalls the window.
+The step counter, simulated time and the optional trajectory log live here so they stay in step
+with the system whichever thread advances it.
+
+Everything that touches the live system from outside the physics thread (restoring a checkpoint,
+saving one) must hold `lock`. G and dt can be changed at any time by assigning `g` and `dt`.
+The other settings (solver, method, ...) come from `config`, a SimulationConfig.
+"""
+class PhysicsRunner:
+    def __init__(self, bodies, g, dt, step_count=0, sim_time=0.0, log=None, config=sim.DEFAULTS):
+        self.bodies = bodies
+        self.config = config
+        self.g = g
+        self.dt = dt
+        self.step_count = step_count
+        self.sim_time = sim_time
+        self.log = log
+        self.lock = threading.Lock()
+        self.running = threading.Event() #cleared while paused
+        self.wanted = threading.Event() #set when the renderer has taken the last published frame
+        self.published = None
+        self.thread = None
+        self.stopping = False
+        self.error = None
+
+    """
+    Take `steps` physics steps on the calling thread
+    """
+    def advance(self, steps=1):
+        with self.lock:
+            for _ in range(steps):
+                with profiler.phase("step"):
+                    sim.step(self.bodies, self.g, self.dt, self.config)
+                self.step_count += 1
+                self.sim_time += self.dt
+                if self.log is not None:
+                    with profiler.phase("log"):
+                        self.log.append(self.bodies, self.step_count, self.sim_time)
+
+    """
+    Start stepping on a background thread. The thread idles until resume() is called.
+    """
+    def start(self):
+        self.publish()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while not self.stopping:
+            if not self.running.wait(0.1):
+                continue
+            try:
+                self.advance()
+            except Exception as e:
+                self.error = e
+                self.running.clear()
+                return
+            #only copy the system when the renderer is ready for a new frame
+            if self.wanted.is_set():
+                self.wanted.clear()
+                self.publish()
+
+    """
+    Publish a copy of the system for the renderer, with the merges so far
+    """
+    def publish(self):
+        with self.lock:
+            system = self.bodies.take(np.arange(len(self.bodies)))
+            system.merges = list(self.bodies.merges)
+            self.published = (system, self.step_count, self.sim_time)
+
+    """
+    The state to draw, as (system, step counter, simulated time). In threaded mode this is the
+    latest published copy and asks the physics thread for a fresh one, otherwise the live system.
+    """
+    def sample(self):
+        if self.error is not None:
+            raise self.error
+        if self.thread is None:
+            return self.bodies, self.step_count, self.sim_time
+        self.wanted.set()
+        return self.published
+
+    """
+    Swap in another system, after a restore, and the log to continue in if it changes.
+    Publishes it straight away so the renderer shows it.
+    """
+    def replace(self, bodies, g, dt, step_count, sim_time, config=None, log=None):
+        with self.lock:
+            self.bodies, self.g, self.dt = bodies, g, dt
+            self.config = self.config if config is None else config
+            self.log = self.log if log is None else log
+            self.step_count, self.sim_time = step_count, sim_time
+        if self.thread is not None:
+            self.publish()
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    @property
+    def paused(self):
+        return not self.running.is_set()
+
+    """
+    Stop the physics thread, waiting for the step in progress
+    """
+    def stop(self):
+        self.stopping = True
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+"""
+Ratio of simulated time to wall clock time, averaged over `window` seconds of wall time
+"""
+class SpeedMeter:
+    def __init__(self, window=0.5):
+        self.window = window
+        self.ratio = 0.0
+        self.steps_per_second = 0.0
+        self.last = None
+
+    def update(self, step_count, sim_time):
+        now = time.perf_counter()
+        if self.last is None:
+            self.last = (now, step_count, sim_time)
+            return self.ratio
+        wall, steps, t = self.last
+        if now - wall >= self.window:
+            self.ratio = (sim_time - t) / (now - wall)
+            self.steps_per_second = (step_count - steps) / (now - wall)
+            self.last = (now, step_count, sim_time)
+        return self.ratio
+
+    """
+    Start measuring again, after a pause or a restore
+    """
+    def reset(self):
+        self.ratio = 0.0
+        self.steps_per_second = 0.0
+        self.last = None
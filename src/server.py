@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import io
+import os
+import bodies as sim
+from simulation_config import SimulationConfig, VALID_PRECISIONS
+from checkpoint import save_checkpoint, load_checkpoint
+from runner import PhysicsRunner
+from protocol import FRAME, JSON, QUANTUM, FrameEncoder, pack, pack_json, read_message
+
+"""
+Simulation server.
+
+Runs one simulation on a background physics thread and streams its state to any number of
+viewers over TCP or a Unix socket, in the format described in protocol.py. Every viewer picks its
+own frame rate, and frames are dropped for a viewer whose connection cannot keep up rather than
+queued, so a slow viewer never stalls the simulation or the other viewers. Viewers control the run
+like the GUI sidebar does (G, dt, Start/Stop, Reset), and every viewer is told about the change.
+
+    python server.py --config simulation_config.json --port 5757
+    python viewer.py --port 5757
+"""
+MAX_FPS = 120
+HIGH_WATER = 1 << 20 #bytes queued for a viewer above which its frames are dropped
+
+"""
+One connected viewer
+"""
+class Client:
+    def __init__(self, reader, writer, fps):
+        self.reader = reader
+        self.writer = writer
+        self.fps = fps
+        self.encoder = FrameEncoder()
+        self.last = None #(generation, step) of the last frame sent
+        self.sent = 0
+        self.dropped = 0
+
+    def send(self, message):
+        self.writer.write(message)
+
+class SimulationServer:
+    def __init__(self, config, start=False):
+        self.config = config
+        bodies = sim.load_bodies(config)
+        #starting state for resets
+        self.initial_checkpoint = io.BytesIO()
+        save_checkpoint(self.initial_checkpoint, bodies, config.G, config.g_scaled, config.dt, config.method)
+        self.G = config.G
+        self.runner = PhysicsRunner(bodies, config.g_scaled, config.dt, config=config)
+        self.generation = 0 #counts resets, so viewers are sent a keyframe of the new system
+        self.clients = set()
+        self.runner.start()
+        if start:
+            self.runner.resume()
+
+    def status(self):
+        return {"type": "status", "G": self.G, "dt": self.runner.dt, "paused": self.runner.paused}
+
+    def hello(self):
+        return {**self.status(), "type": "hello", "quantum": QUANTUM, "method": self.config.method,
+                "solver": self.config.solver, "precision": self.config.precision, "bodies": len(self.runner.bodies)}
+
+    def broadcast(self, message):
+        data = pack_json(message)
+        for client in self.clients:
+            client.send(data)
+
+    """
+    Apply a control message from a viewer
+    """
+    def control(self, client, message):
+        match message.get("type"):
+            case "subscribe":
+                client.fps = min(max(float(message.get("fps", client.fps)), 1), MAX_FPS)
+                return
+            case "set":
+                if "G" in message:
+                    self.G = float(message["G"])
+                    self.runner.g = self.config.scaled_g(self.G)
+                if "dt" in message:
+                    self.runner.dt = float(message["dt"])
+            case "start":
+                self.runner.resume()
+            case "stop":
+                self.runner.pause()
+            case "toggle":
+                if self.runner.paused:
+                    self.runner.resume()
+                else:
+                    self.runner.pause()
+            case "reset":
+                self.reset()
+            case other:
+                print(f"ERROR: Unknown message type {other}")
+                return
+        self.broadcast(self.status())
+
+    """
+    Go back to the starting state, keeping the current G and dt
+    """
+    def reset(self):
+        self.initial_checkpoint.seek(0)
+        bodies, state = load_checkpoint(self.initial_checkpoint)
+        bodies.convert(self.config.dtype)
+        self.runner.replace(bodies, self.runner.g, self.runner.dt, state["step"], state["time"])
+        self.generation += 1
+        print(f"DEBUG: Reset, G={self.G}, dt={self.runner.dt}")
+
+    """
+    Send the latest state to a viewer at its frame rate, skipping frames while its connection is backed up
+    """
+    async def stream(self, client):
+        while True:
+            await asyncio.sleep(1 / client.fps)
+            system, step, time = self.runner.sample()
+            if client.last == (self.generation, step):
+                continue
+            if client.writer.transport.get_write_buffer_size() > HIGH_WATER:
+                client.dropped += 1
+                continue
+            client.send(pack(FRAME, client.encoder.encode(system, step, time, self.generation)))
+            client.last = (self.generation, step)
+            client.sent += 1
+
+    async def handle(self, reader, writer):
+        client = Client(reader, writer, self.config.fps)
+        self.clients.add(client)
+        client.send(pack_json(self.hello()))
+        streaming = asyncio.create_task(self.stream(client))
+        try:
+            while True:
+                kind, message = await read_message(reader)
+                if kind == JSON:
+                    self.control(client, message)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            streaming.cancel()
+            self.clients.discard(client)
+            writer.close()
+            print(f"DEBUG: Viewer left, {client.sent} frames sent, {client.dropped} dropped")
+
+    """
+    Serve on a Unix socket at `path` if given, otherwise on TCP host:port, until cancelled
+    """
+    async def serve(self, host="127.0.0.1", port=5757, path=None):
+        if path:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        print(f"DEBUG: Serving on {path or f'{host}:{port}'}, G={self.G}, dt={self.runner.dt}, bodies={len(self.runner.bodies)}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.runner.stop()
+            if path and os.path.exists(path):
+                os.remove(path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve an N-Body simulation to viewers")
+    parser.add_argument("-c", "--config", default="simulation_config.json", help="Path to the simulation config")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=5757, help="TCP port to listen on")
+    parser.add_argument("--unix", help="Listen on this Unix socket path instead of TCP")
+    parser.add_argument("-p", "--precision", choices=VALID_PRECISIONS, help="Precision of the positions, velocities and forces, overrides the config")
+    parser.add_argument("--start", action="store_true", help="Start simulating straight away instead of waiting for a viewer to press Start")
+    args = parser.parse_args(argv)
+
+    overrides = {"precision": args.precision} if args.precision else {}
+    server = SimulationServer(SimulationConfig.load(args.config, **overrides), args.start)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
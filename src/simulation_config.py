@@ -0,0 +1,185 @@
+import json
+import numpy as np
+from integrators import INTEGRATORS
+
+"""
+Simulation configuration.
+
+A SimulationConfig holds every setting of one simulation: the defaults below, overridden by a
+configuration file and then by any keyword overrides. Nothing is read from disk until load() is
+called, and every function that needs a setting takes the config it should use, so differently
+configured simulations can run side by side in one process. Configs are not changed after they
+are made; replace() returns a copy with some settings changed.
+"""
+
+"""
+List of numerical methods (see integrators.py):
+
+CA - constant acceleration
+VER - Verlet integration
+KDK - kick-drift-kick leapfrog
+YOSHIDA4 - 4th order Yoshida symplectic method
+RK4 - 4th order Runge Kutta method
+"""
+VALID_METHODS = list(INTEGRATORS)
+
+"""
+List of force solvers:
+
+DIRECT - direct summation over every pair of bodies, O(N^2)
+BH - Barnes-Hut quadtree, O(N log N), accuracy controlled by the opening angle theta
+PM - particle-mesh with an FFT potential solve, near O(N), for dense and roughly uniform distributions
+PAR - direct summation split across a pool of worker processes
+"""
+VALID_SOLVERS = ["DIRECT", "BH", "PM", "PAR"]
+
+"""
+List of precisions, with the type positions, velocities and accelerations are stored in and the
+type the forces on every body are summed in:
+
+float64 - double precision throughout
+float32 - single precision throughout, half the memory and about twice the force throughput
+mixed - stored and computed in single precision, but the forces on every body accumulated in double precision
+"""
+PRECISIONS = {
+    "float64": (np.float64, np.float64),
+    "float32": (np.float32, np.float32),
+    "mixed": (np.float32, np.float64),
+}
+VALID_PRECISIONS = list(PRECISIONS)
+
+"""
+List of kernel backends:
+
+numpy - vectorized NumPy, always available
+numba - loops compiled with Numba (see jit.py) for the direct summation forces, the leapfrog and
+        Verlet updates and the collision test, falling back to numpy when Numba is not installed
+"""
+VALID_BACKENDS = ["numpy", "numba"]
+
+#default configuration, used for any key missing from simulation_config.json
+DEFAULT_CONFIG = {
+    "km_per_pixel" : 200,
+    "mass_stability_scale" : 1e-15,
+    "distance_stability_scale" : 10,
+    "G" : 6.67e-11,
+    "dt" : 2 ,
+    "method" : "VER",
+    "TRACER" : True,
+    "tracer_length" : 1500,
+    "tracer_decimation" : 1,
+    "LOGGING" : False,
+    "log_path" : "trajectory.nbt",
+    "log_stride" : 1,
+    "checkpoint_dir" : "checkpoints",
+    "solver" : "DIRECT",
+    "theta" : 0.5,
+    "pm_grid" : 256,
+    "pm_cell_km" : 1600,
+    "workers" : 0,
+    "softening_km" : 200,
+    "direct_memory_kb" : 2048,
+    "adaptive" : False,
+    "eta" : 0.02,
+    "max_level" : 8,
+    "substeps" : 1,
+    "threaded" : False,
+    "fps" : 60,
+    "precision" : "float64",
+    "diagnostics" : False,
+    "diagnostics_jerk" : False,
+    "backend" : "numpy",
+    "bodies" : []
+}
+
+"""
+Load a user-defined configuration file, filling in defaults for missing keys.
+A missing file falls back to the defaults, a file that is not valid JSON is an error.
+"""
+def load_config(path="simulation_config.json"):
+    try:
+        with open(path) as f:
+            loaded = json.load(f)
+    except FileNotFoundError:
+        loaded = {}
+        print(f"ERROR: Could not find {path}. Using default parameters instead.")
+    except ValueError as e:
+        raise ValueError(f"{path} is not a valid configuration: {e}") from e
+    return {**DEFAULT_CONFIG, **loaded}
+
+class SimulationConfig:
+    def __init__(self, values=None, **overrides):
+        self.values = {**DEFAULT_CONFIG, **(values or {}), **overrides}
+        values = self.values
+        self.km_per_pixel = values["km_per_pixel"]
+        self.m_per_pixel = self.km_per_pixel * 1000
+        self.mass_stability_scale = values["mass_stability_scale"]
+        self.distance_stability_scale = values["distance_stability_scale"]
+        self.G = values["G"] #expressed in m^3/(kg*s^2)
+        self.g_scaled = self.scaled_g(self.G)
+        self.dt = values["dt"] #expressed in seconds
+        self.method = values["method"] #numerical method
+        self.tracer = values["TRACER"]
+        self.tracer_length = values["tracer_length"] #points kept per trail
+        self.tracer_decimation = values["tracer_decimation"] #record a trail point every this many frames
+        self.logging = values["LOGGING"] #stream a trajectory to log_path
+        self.log_path = values["log_path"]
+        self.log_stride = values["log_stride"] #only every log_stride-th step is logged
+        self.checkpoint_dir = values["checkpoint_dir"]
+        self.solver = values["solver"] #force solver
+        self.theta = values["theta"] #Barnes-Hut opening angle
+        self.pm_grid = values["pm_grid"] #particle-mesh cells per side
+        self.pm_cell = values["pm_cell_km"] / self.km_per_pixel #particle-mesh cell size in pixels
+        self.workers = values["workers"] #worker processes for the parallel solver, 0 uses every core
+        self.softening = values["softening_km"] / self.km_per_pixel #Plummer softening length in pixels
+        self.direct_budget = values["direct_memory_kb"] * 1024 #bytes of pairwise temporaries per direct summation tile
+        self.adaptive = values["adaptive"] #use block timesteps instead of one global dt
+        self.eta = values["eta"] #block timestep accuracy parameter
+        self.max_level = values["max_level"] #smallest block timestep is dt / 2**max_level
+        self.substeps = values["substeps"] #physics steps per rendered frame
+        self.threaded = values["threaded"] #run the physics on a background thread, decoupled from rendering
+        self.fps = values["fps"] #frame rate limit of the renderer
+        self.precision = values["precision"]
+        self.diagnostics = values["diagnostics"] #record the potential energy in the force sweep, see bodies.diagnostics()
+        self.diagnostics_jerk = values["diagnostics_jerk"] #also record the jerk on every body, which about doubles the cost of the sweep
+        self.backend = values["backend"] #kernels the direct forces, updates and collision test run on
+        self.bodies = values["bodies"]
+
+        #sanity check
+        if self.method not in VALID_METHODS:
+            raise ValueError(f"Invalid numerical method {self.method}, expected one of {VALID_METHODS}")
+        if self.solver not in VALID_SOLVERS:
+            raise ValueError(f"Invalid force solver {self.solver}, expected one of {VALID_SOLVERS}")
+        if self.precision not in VALID_PRECISIONS:
+            raise ValueError(f"Invalid precision {self.precision}, expected one of {VALID_PRECISIONS}")
+        self.dtype, self.accumulate_dtype = PRECISIONS[self.precision]
+        if self.backend not in VALID_BACKENDS:
+            raise ValueError(f"Invalid backend {self.backend}, expected one of {VALID_BACKENDS}")
+
+    """
+    Configuration from a file, see load_config(), with keyword overrides on top
+    """
+    @classmethod
+    def load(cls, path="simulation_config.json", **overrides):
+        return cls(load_config(path), **overrides)
+
+    """
+    Copy of this configuration with some settings changed, by their configuration file keys
+    """
+    def replace(self, **changes):
+        return SimulationConfig(self.values, **changes)
+
+    """
+    G in the simulation's units of pixels and scaled masses
+    """
+    def scaled_g(self, G):
+        return G * self.m_per_pixel ** 3 * self.mass_stability_scale
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __repr__(self):
+        return f"SimulationConfig({self.values!r})"
+
+#settings used whenever no configuration is given, built without reading any file
+DEFAULTS = SimulationConfig()
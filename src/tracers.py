@@ -0,0 +1,69 @@
+import numpy as np
+
+"""
+Tracer storage for the trails drawn behind every body.
+
+All trails share one preallocated (N, L, 2) ring buffer, so recording a point for every body is a single
+array write and old points are overwritten in place instead of being popped off a list. Only every
+`decimation`-th recorded position is kept. Rows follow the bodies by id, so trails survive merges.
+"""
+class TracerBuffer:
+    def __init__(self, ids, length=1500, decimation=1):
+        self.length = length
+        self.decimation = decimation
+        self.calls = 0
+        self.reset(ids)
+
+    """
+    Forget every trail and start over for the bodies with the given ids
+    """
+    def reset(self, ids):
+        self.ids = np.array(ids)
+        self.points = np.zeros((len(self.ids), self.length, 2), dtype=np.float32)
+        self.filled = np.zeros(len(self.ids), dtype=np.int64) #valid points per row
+        self.head = 0 #slot the next point goes into
+
+    """
+    Follow the bodies of a system after merges: rows of surviving ids are kept, new ids start empty
+    """
+    def sync(self, ids):
+        ids = np.asarray(ids)
+        if len(ids) == len(self.ids) and np.array_equal(ids, self.ids):
+            return
+        points = np.zeros((len(ids), self.length, 2), dtype=np.float32)
+        filled = np.zeros(len(ids), dtype=np.int64)
+        if len(self.ids):
+            order = np.argsort(self.ids)
+            rows = order[np.minimum(np.searchsorted(self.ids, ids, sorter=order), len(self.ids) - 1)]
+            known = self.ids[rows] == ids
+            points[known] = self.points[rows[known]]
+            filled[known] = self.filled[rows[known]]
+        self.ids, self.points, self.filled = ids.copy(), points, filled
+
+    """
+    Offer the current positions of a system. Returns True if a point was recorded.
+    """
+    def append(self, bodies):
+        self.calls += 1
+        if (self.calls - 1) % self.decimation:
+            return False
+        self.sync(bodies.ids)
+        self.points[:, self.head] = bodies.position
+        self.filled = np.minimum(self.filled + 1, self.length)
+        self.head = (self.head + 1) % self.length
+        return True
+
+    """
+    The two most recent points of every body, and which bodies have both
+    """
+    def last_segments(self):
+        latest = self.points[:, (self.head - 1) % self.length]
+        before = self.points[:, (self.head - 2) % self.length]
+        return before, latest, self.filled >= 2
+
+    """
+    Trail of row i, oldest point first
+    """
+    def trail(self, i):
+        n = self.filled[i]
+        return np.roll(self.points[i], -self.head, axis=0)[self.length - n:]
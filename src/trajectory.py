@@ -0,0 +1,226 @@
+import json
+import os
+import queue
+import threading
+import numpy as np
+
+"""
+Streaming trajectory files.
+
+A trajectory file is a fixed size header followed by fixed size frame records. Every frame holds
+the step, the simulated time, the number of bodies alive and the ids, positions, velocities and
+masses of those bodies, padded up to the file's capacity (the body count of the first frame, since
+merges only ever remove bodies). Body ids are the ParticleSystem ids, so a body keeps its id for
+the whole run and merged bodies simply stop appearing.
+
+Header layout:
+[0:8] magic, [8:16] frames written (uint64), [16:24] length of the JSON metadata, [24:HEADER_SIZE] metadata
+
+The writer grows the file one chunk of frames at a time and writes frames through a memory map of
+the current chunk, on a background thread so the step loop only pays for copying the arrays.
+Readers memory-map the whole file, so frames can be sliced without reading the file into memory.
+
+A run continued from a checkpoint reopens its log with `resume` set to the restored step, and the
+frames from that step on are dropped, so the file keeps one frame per logged step in order. A run
+that jumps back without continuing its log (a GUI reset or restore) starts a new file, see next_path().
+"""
+MAGIC = b"NBODYTRJ"
+HEADER_SIZE = 4096
+
+def frame_dtype(capacity):
+    return np.dtype([
+        ("step", np.int64),
+        ("time", np.float64),
+        ("count", np.int64),
+        ("ids", np.int64, (capacity,)),
+        ("position", np.float64, (capacity, 2)),
+        ("velocity", np.float64, (capacity, 2)),
+        ("mass", np.float64, (capacity,)),
+    ])
+
+"""
+First of path, path_1, path_2, ... (numbered before the extension) that does not exist yet
+"""
+def next_path(path):
+    root, ext = os.path.splitext(path)
+    n = 0
+    while os.path.exists(path):
+        n += 1
+        path = f"{root}_{n}{ext}"
+    return path
+
+"""
+Writes a trajectory file. With `resume` set to a step counter, an existing file at `path` is continued
+instead of replaced: its frames from that step on are dropped, and the next frame is written after the
+last one kept. The file keeps its own capacity and metadata, which must fit the run being continued.
+"""
+class TrajectoryWriter:
+    def __init__(self, path, capacity, stride=1, chunk=256, metadata=None, queue_size=64, resume=None):
+        self.path = path
+        self.capacity = capacity
+        self.stride = stride
+        self.chunk = chunk
+        self.frames = 0 #frames written to the file
+        self.chunk_start = 0
+        self.mapped = None
+
+        if resume is not None and os.path.exists(path):
+            self._reopen(resume)
+        else:
+            meta = json.dumps({"capacity": capacity, "stride": stride, **(metadata or {})}).encode()
+            if len(meta) > HEADER_SIZE - 24:
+                raise ValueError("Trajectory metadata does not fit in the header")
+            with open(path, "wb") as f:
+                f.write(MAGIC)
+                f.write(np.uint64(0).tobytes())
+                f.write(np.uint64(len(meta)).tobytes())
+                f.write(meta.ljust(HEADER_SIZE - 24, b"\0"))
+        self.dtype = frame_dtype(self.capacity)
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    """
+    Offer the current state of a system at step counter `step`. Only steps that are a multiple of
+    `stride` are written, so the frames stay evenly spaced when a run is resumed at any step.
+    The arrays are copied here and written to the file on the writer thread.
+    """
+    def append(self, bodies, step, t):
+        if step % self.stride:
+            return
+        if self.error is not None:
+            raise self.error
+        n = len(bodies)
+        if n > self.capacity:
+            raise ValueError(f"Trajectory was created for {self.capacity} bodies, got {n}")
+        self.queue.put((step, t, bodies.ids.copy(), bodies.position.copy(), bodies.velocity.copy(), bodies.mass.copy()))
+
+    """
+    Continue the file at self.path from step `resume`, keeping the frames written before it
+    """
+    def _reopen(self, resume):
+        existing = Trajectory(self.path)
+        if existing.capacity < self.capacity:
+            raise ValueError(f"Trajectory {self.path} was created for {existing.capacity} bodies, got {self.capacity}")
+        if existing.metadata["stride"] != self.stride:
+            raise ValueError(f"Trajectory {self.path} was written every {existing.metadata['stride']} steps, got {self.stride}")
+        self.capacity = existing.capacity
+        #steps only increase within a file, so the frames to keep are the ones before `resume`
+        self.frames = int(np.searchsorted(existing.frames["step"], resume))
+        size = HEADER_SIZE + self.frames * existing.frames.dtype.itemsize
+        del existing
+        with open(self.path, "r+b") as f:
+            f.truncate(size)
+            f.seek(len(MAGIC))
+            f.write(np.uint64(self.frames).tobytes())
+
+    def _map_chunk(self):
+        if self.mapped is not None:
+            self.mapped.flush()
+        self.chunk_start = self.frames
+        offset = HEADER_SIZE + self.chunk_start * self.dtype.itemsize
+        with open(self.path, "r+b") as f:
+            f.truncate(offset + self.chunk * self.dtype.itemsize)
+        self.mapped = np.memmap(self.path, dtype=self.dtype, mode="r+", offset=offset, shape=(self.chunk,))
+
+    def _write(self, step, t, ids, position, velocity, mass):
+        if self.mapped is None or self.frames - self.chunk_start == self.chunk:
+            self._map_chunk()
+        n = len(mass)
+        record = self.mapped[self.frames - self.chunk_start]
+        record["step"], record["time"], record["count"] = step, t, n
+        record["ids"][:n] = ids
+        record["position"][:n] = position
+        record["velocity"][:n] = velocity
+        record["mass"][:n] = mass
+        self.frames += 1
+
+    def _drain(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    self._write(*item)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    """
+    Wait for every queued frame and record the frame count in the header, so readers see them
+    """
+    def flush(self):
+        self.queue.join()
+        if self.mapped is not None:
+            self.mapped.flush()
+        with open(self.path, "r+b") as f:
+            f.seek(len(MAGIC))
+            f.write(np.uint64(self.frames).tobytes())
+        if self.error is not None:
+            raise self.error
+
+    """
+    Flush, stop the writer thread and trim the unused part of the last chunk
+    """
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.mapped = None
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER_SIZE + self.frames * self.dtype.itemsize)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Trajectory:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a trajectory file")
+            count = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            self.metadata = json.loads(f.read(length))
+        self.capacity = self.metadata["capacity"]
+        self.frames = np.memmap(path, dtype=frame_dtype(self.capacity), mode="r", offset=HEADER_SIZE, shape=(count,)) if count else np.empty(0, dtype=frame_dtype(self.capacity))
+
+    def __len__(self):
+        return len(self.frames)
+
+    """
+    Frame records, a slice gives a zero-copy view of the file
+    """
+    def __getitem__(self, i):
+        return self.frames[i]
+
+    """
+    The state of frame i trimmed to the bodies alive in it
+    """
+    def frame(self, i):
+        record = self.frames[i]
+        n = int(record["count"])
+        return {
+            "step": int(record["step"]),
+            "time": float(record["time"]),
+            "ids": record["ids"][:n],
+            "position": record["position"][:n],
+            "velocity": record["velocity"][:n],
+            "mass": record["mass"][:n],
+        }
+
+    """
+    Track of one body over frames[start:stop]: the frames it is alive in, and its positions in them
+    """
+    def track(self, body_id, start=None, stop=None):
+        frames = self.frames[start:stop]
+        hit = frames["ids"] == body_id
+        hit &= np.arange(self.capacity)[np.newaxis, :] < frames["count"][:, np.newaxis]
+        which, slot = np.nonzero(hit)
+        return frames["step"][which], frames["position"][which, slot]
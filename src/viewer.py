@@ -0,0 +1,138 @@
+import os
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+import argparse
+import socket
+import threading
+import numpy as np
+from bodies import ParticleSystem
+from gui import *
+from tracers import TracerBuffer
+from runner import SpeedMeter
+from protocol import FRAME, JSON, FrameDecoder, pack_json, recv_message
+
+"""
+Thin viewer for server.py.
+
+Draws a simulation running in a server process, with the same sidebar as main.py: the G and dt
+sliders, Start/Stop and Reset are sent to the server, which applies them and tells every viewer.
+A background thread receives the stream and keeps only the latest state, so drawing never falls
+behind the network.
+
+    python viewer.py --host 127.0.0.1 --port 5757
+    python viewer.py --unix /tmp/nbody.sock
+"""
+parser = argparse.ArgumentParser()
+parser.add_argument("--host", default="127.0.0.1", help="Address of the server")
+parser.add_argument("--port", type=int, default=5757, help="TCP port of the server")
+parser.add_argument("--unix", help="Connect to this Unix socket path instead of TCP")
+parser.add_argument("--fps", type=float, default=60, help="Frame rate to draw at and to ask the server for")
+parser.add_argument("--no-tracer", action="store_true", help="Do not draw trails")
+args = parser.parse_args()
+
+if args.unix:
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(args.unix)
+else:
+    connection = socket.create_connection((args.host, args.port))
+connection.sendall(pack_json({"type": "subscribe", "fps": args.fps}))
+kind, hello = recv_message(connection)
+G, dt = hello["G"], hello["dt"]
+
+"""
+Latest state sent by the server, updated by the receiving thread
+"""
+class Stream:
+    def __init__(self, quantum):
+        self.decoder = FrameDecoder(quantum)
+        self.lock = threading.Lock()
+        self.status = None #newest status message not yet shown
+        self.keyframes = 0
+        self.error = None
+
+    def receive(self):
+        try:
+            while True:
+                kind, message = recv_message(connection)
+                with self.lock:
+                    if kind == FRAME:
+                        self.decoder.apply(message)
+                    elif kind == JSON and message["type"] == "status":
+                        self.status = message
+        except (ConnectionError, OSError) as e:
+            self.error = e
+
+    """
+    The latest frame as a ParticleSystem, with its step and simulated time, and whether the
+    server sent a different system since the last call (a reset)
+    """
+    def latest(self):
+        with self.lock:
+            system = ParticleSystem.from_arrays(**self.decoder.arrays())
+            changed = self.decoder.keyframes != self.keyframes
+            self.keyframes = self.decoder.keyframes
+            return system, self.decoder.step, self.decoder.time, changed
+
+stream = Stream(hello["quantum"])
+threading.Thread(target=stream.receive, daemon=True).start()
+
+#GUI Screen Settigns
+pygame.init()
+width, height = 1600, 1200
+screen = pygame.display.set_mode((width, height), vsync=True)
+pygame.display.set_caption(f"N-Body Viewer ({hello['bodies']} bodies, {hello['solver']}, {hello['method']})")
+
+tracers = TracerBuffer(np.empty(0, dtype=np.int64))
+trails = TrailLayer((width, height), tracers.length)
+clock = pygame.time.Clock()
+speed = SpeedMeter()
+paused = hello["paused"]
+
+#simulation gui objects, shared with main.py
+panel = ControlPanel(screen, G, dt)
+
+def send(message):
+    connection.sendall(pack_json(message))
+
+running = True
+while running:
+    #Get user inputs
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+            running = False
+        panel.update(event, lambda: send({"type": "toggle"}), lambda: send({"type": "reset"}))
+
+    #slider changes go to the server, changes made by other viewers come back as status messages
+    if panel.g_slider.value != G or panel.dt_slider.value != dt:
+        G, dt = float(panel.g_slider.value), float(panel.dt_slider.value)
+        send({"type": "set", "G": G, "dt": dt})
+    with stream.lock:
+        status, stream.status = stream.status, None
+    if status is not None:
+        G, dt = status["G"], status["dt"]
+        panel.set_values(G, dt)
+        if status["paused"] != paused:
+            paused = status["paused"]
+            speed.reset()
+    if stream.error is not None:
+        print(f"ERROR: Lost the server: {stream.error}")
+        break
+
+    system, step_count, sim_time, changed = stream.latest()
+    if changed:
+        tracers.reset(system.ids)
+        trails.clear()
+        speed.reset()
+    speed.update(step_count, sim_time)
+
+    #tracer trails
+    if not args.no_tracer:
+        trails.update(screen, tracers, system)
+    else:
+        screen.fill(BLACK)
+
+    panel.draw(system, speed, sim_time)
+    pygame.display.flip()
+    clock.tick(args.fps)
+
+connection.close()
+pygame.quit()